@@ -1,9 +1,14 @@
+import heapq
+import itertools
 from collections import defaultdict
 
-from derivation import initialize_partial_derivations_for_all_templates
+from derivation import (initialize_partial_derivations_for_all_templates,
+                        solve_complete_derivations)
 
 MAX_TOTAL = 200
 MAX_PER_TEMPLATE = 20
+# Number of candidates solved and scored together
+SCORE_CHUNK = 200
 
 
 def beam_search(word_problem, unique_templates,
@@ -20,46 +25,72 @@ def prune_beam(beam, validation_func):
     return [d for d in beam if validation_func(d)]
 
 
-def search_to_completion(beam, score_func, validation_func):
-    pre_pruned = prune_beam(beam, validation_func)
-    if all(derivation.is_complete() for derivation in pre_pruned):
-        return pre_pruned
-
-    candidates = list()
+def expand_beam(beam):
+    '''Generates the candidates for the next beam step. Complete
+       derivations are carried over as they are'''
     for derivation in beam:
         if derivation.is_complete():
-            candidates.append(derivation)
+            yield derivation
         else:
-            candidates.extend(derivation.all_ways_to_fill_next_slot())
-
-    post_pruned = prune_beam(candidates, validation_func)
-    best_first = sorted(post_pruned, key=score_func, reverse=True)
-    by_template = defaultdict(list)
-    for derivation in best_first:
-        by_template[derivation.template_index].append(derivation)
-
-    total_after_limit = 0
-    limited_by_template = dict()
-    for template_index, best in by_template.iteritems():
-        # want the best at the end for calls to pop() below
-        limited_by_template[template_index] = list(reversed(
-            best[:MAX_PER_TEMPLATE]))
-        total_after_limit += len(limited_by_template[template_index])
-
-    # cycle through the templates and keep adding the best derivation
-    # for each template until MAX_TOTAL are taken or there are no more
-    output_size = min(total_after_limit, MAX_TOTAL)
-    output_beam = list()
-    keys = limited_by_template.keys()
-    key_index = 0
+            for child in derivation.all_ways_to_fill_next_slot():
+                yield child
+
+
+def best_by_template(candidates, score_func, validation_func):
+    '''Keeps a heap of the MAX_PER_TEMPLATE best derivations for each
+       template while consuming the candidates a chunk at a time,
+       so the full set of candidates is never held in memory'''
+    heaps = defaultdict(list)
     count = 0
-    while count < output_size:
-        key = keys[key_index]
-        derivations = limited_by_template[key]
-        if derivations:
-            output_beam.append(derivations.pop())
+    while True:
+        chunk = list(itertools.islice(candidates, SCORE_CHUNK))
+        if not chunk:
+            break
+
+        solve_complete_derivations(chunk)
+        chunk = prune_beam(chunk, validation_func)
+        # score_func scores the whole chunk at once rather
+        # than being called once per derivation
+        scores = score_func(chunk)
+        for derivation, score in zip(chunk, scores):
+            # Among equal scores the earlier candidate is kept
+            entry = (score, -count, derivation)
             count += 1
+            heap = heaps[derivation.template_index]
+            if len(heap) < MAX_PER_TEMPLATE:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+    return heaps
+
+
+def search_to_completion(beam, score_func, validation_func):
+    beam = prune_beam(beam, validation_func)
+    while not all(derivation.is_complete() for derivation in beam):
+        heaps = best_by_template(expand_beam(beam), score_func,
+                                 validation_func)
+
+        total_after_limit = 0
+        limited_by_template = dict()
+        for template_index, heap in heaps.iteritems():
+            # want the best at the end for calls to pop() below
+            limited_by_template[template_index] = [
+                derivation for _, _, derivation in sorted(heap)]
+            total_after_limit += len(limited_by_template[template_index])
+
+        # cycle through the templates and keep adding the best derivation
+        # for each template until MAX_TOTAL are taken or there are no more
+        output_size = min(total_after_limit, MAX_TOTAL)
+        beam = list()
+        keys = limited_by_template.keys()
+        key_index = 0
+        while len(beam) < output_size:
+            key = keys[key_index]
+            derivations = limited_by_template[key]
+            if derivations:
+                beam.append(derivations.pop())
 
-        key_index = (key_index + 1) % len(keys)
+            key_index = (key_index + 1) % len(keys)
 
-    return search_to_completion(output_beam, score_func, validation_func)
+    return beam
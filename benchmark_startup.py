@@ -0,0 +1,84 @@
+'''Measures the startup cost of main.py actions: the wall time from
+   process start to the first line of output and the peak memory
+   used by then. Arguments which are not listed below are passed on
+   to main.py, for example:
+
+   $ python benchmark_startup.py --repeat 5 -n sample_parses
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+# Actions which only read their inputs before the first output.
+# find-template-set and add-templates write the template set.
+DEFAULT_ACTIONS = ['print', 'count-unique', 'extract-features', 'fold']
+
+
+def measure(action, main_args):
+    '''Runs one action until its first line of output and returns
+       the seconds that took and the peak RSS in KB'''
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    with open(os.devnull, 'wb') as devnull:
+        start = time.time()
+        process = subprocess.Popen([sys.executable, MAIN, action] + main_args,
+                                   stdout=subprocess.PIPE, stderr=devnull,
+                                   env=env)
+        first_line = process.stdout.readline()
+        elapsed = time.time() - start
+
+        # Only the startup is measured so the rest of the action
+        # is not waited for
+        if process.poll() is None:
+            process.kill()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = status
+        process.stdout.close()
+
+    if not first_line:
+        raise Exception('{} gave no output, exit status {}'
+                        .format(action, status))
+
+    return elapsed, usage.ru_maxrss
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Startup time and memory of main.py actions')
+    parser.add_argument('--actions', type=str, nargs='+',
+                        default=DEFAULT_ACTIONS,
+                        help='actions of main.py to measure')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='measured runs of each action')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='runs of each action before measuring, '
+                             'which fill the template and NLP caches')
+    args, main_args = parser.parse_known_args()
+
+    print('{:<20}{:>18}{:>18}{:>16}'.format(
+        'action', 'median time (s)', 'min time (s)', 'peak RSS (MB)'))
+    for action in args.actions:
+        for _ in range(args.warmup):
+            measure(action, main_args)
+
+        runs = [measure(action, main_args) for _ in range(args.repeat)]
+        times = [t for t, _ in runs]
+        peak_rss = max(rss for _, rss in runs)
+        print('{:<20}{:>18.3f}{:>18.3f}{:>16.1f}'
+              .format(action, median(times), min(times), peak_rss / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
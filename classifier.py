@@ -6,151 +6,166 @@ import numpy
 
 from features import Features
 from beam import beam_search
+from derivation import solve_complete_derivations
 
 
 class Classifier(object):
     def __init__(self, feature_extractor, parameters, unique_templates):
         self.feature_extractor = feature_extractor
+        self.parameters_version = 0
         self.parameters = parameters
         self.unique_templates = unique_templates
-        feature_count = len(feature_extractor.ordered_features)
         self.features = Features(feature_extractor.ordered_features,
-                                 [0 for _ in range(feature_count)])
+                                 numpy.array(list(), dtype=int))
+
+    @property
+    def parameters(self):
+        return self.current_parameters
+
+    # Any score cached on a derivation is out of date
+    # once the parameters change
+    @parameters.setter
+    def parameters(self, parameters):
+        self.current_parameters = parameters
+        self.parameters_version += 1
+
+    def features_of(self, derivation):
+        if derivation.features is None:
+            derivation.features = self.feature_extractor.extract(derivation)
+
+        return derivation.features
+
+    # These scores are the log of probabilities which are
+    # not normalized to be in [0,1]. When applying this
+    # calculation in computing the log probablity and the
+    # gradient need to normalize.
+    def score_derivations(self, derivations):
+        '''Derivations without an up to date score are all
+           scored with a single sparse matrix product'''
+        stale = [d for d in derivations
+                 if d.score_version != self.parameters_version]
+        if stale:
+            matrix = Features.matrix([self.features_of(d) for d in stale],
+                                     len(self.parameters))
+            for d, log_score in zip(stale, matrix.dot(self.parameters)):
+                d.log_score = log_score
+                d.score_version = self.parameters_version
+
+        return numpy.array([d.log_score for d in derivations])
 
-    # These probabilities are not normalized to
-    # be in [0,1]. When applying this calculation
-    # in computing the log probablity and the gradient
-    # need to normalize.
-    def probability_of_derivation(self, derivation):
-        features = self.feature_extractor.extract(derivation)
-        array = numpy.array(features.instance)
-        return math.exp(array.dot(self.parameters))
-
-    def log_likelihood(self, word_problems, wp_template_indices,
-                       unique_templates):
-
-        def score_func(derivation):
-            return self.probability_of_derivation(derivation)
-
-        def final_evaluation_func(derivations):
-            if len(derivations) == 0:
-                print('no derivations in beam for log likelihood')
-            probs = list()
-            for d in derivations:
-                probs.append(score_func(d))
-
-            total = sum(probs)
-            result = 0
-            for p in probs:
-                result += math.log(p / total)
-
-            return result
+    @staticmethod
+    def log_sum_exp(values):
+        largest = values.max()
+        return largest + math.log(numpy.exp(values - largest).sum())
+
+    def score_beam(self, derivations):
+        '''Returns the log likelihood of the derivations normalized
+           over the beam and the expected feature vector of the beam'''
+        if len(derivations) == 0:
+            print('no derivations in beam')
+            return 0, numpy.zeros(len(self.parameters))
+
+        log_scores = self.score_derivations(derivations)
+        log_probs = log_scores - self.log_sum_exp(log_scores)
+        matrix = Features.matrix([self.features_of(d) for d in derivations],
+                                 len(self.parameters))
+        return log_probs.sum(), matrix.T.dot(numpy.exp(log_probs))
+
+    def log_likelihood_and_gradient(self, word_problems, wp_template_indices,
+                                    unique_templates):
+        '''Both are computed from the same beam searches. The log
+           likelihood only needs the beam constrained to derivations
+           of the correct solution and the gradient also needs the
+           unconstrained beam'''
 
         total = 0
-        for i, wp in enumerate(word_problems):
-            correct_index = wp_template_indices[i]
-            solutions = wp.labeled_example.solutions
-
-            print('ll for wp: {} with template: {}, with solutions: {}'
-                  .format(i, correct_index, solutions))
-
-            def validator_func(d):
-                return self.can_derive_correct_equations(d, correct_index,
-                                                         solutions)
-
-            total += beam_search(wp, unique_templates, score_func,
-                                 validator_func, final_evaluation_func)
-            print('log likelihood total after word problem: {} is {}'
-                  .format(i, total))
-
-        return total
-
-    def log_likelihood_gradient(self, word_problems, wp_template_indices,
-                                unique_templates):
-
-        def score_func(derivation):
-            return self.probability_of_derivation(derivation)
-
-        def final_evaluation_func(derivations):
-            if len(derivations) == 0:
-                print('no derivations in beam for log likelihood gradient')
-            gradient = numpy.zeros(len(self.parameters))
-            probs = list()
-            for d in derivations:
-                prob = score_func(d)
-                probs.append(prob)
-                instance = self.feature_extractor.extract(d).instance
-                gradient += prob * numpy.array(instance)
-
-            total_prob = sum(probs)
-            if total_prob == 0:
-                print('no probablity to normalize in gradient')
-                return gradient
-
-            return gradient / total_prob
-
         total_gradient = numpy.zeros(len(self.parameters))
         for i, wp in enumerate(word_problems):
             correct_index = wp_template_indices[i]
             solutions = wp.labeled_example.solutions
 
-            print('ll gradient for wp: {} with template: {}'
-                  .format(i, correct_index))
+            print('ll and gradient for wp: {} with template: {}, '
+                  'with solutions: {}'.format(i, correct_index, solutions))
 
             def validator_func(d):
                 return self.can_derive_correct_equations(d, correct_index,
                                                          solutions)
 
-            total_gradient += beam_search(wp, unique_templates, score_func,
-                                          validator_func,
-                                          final_evaluation_func)
+            log_likelihood, correct_expected = beam_search(
+                wp, unique_templates, self.score_derivations, validator_func,
+                self.score_beam)
+            _, all_expected = beam_search(
+                wp, unique_templates, self.score_derivations, lambda d: True,
+                self.score_beam)
 
-            total_gradient -= beam_search(wp, unique_templates, score_func,
-                                          lambda d: True,
-                                          final_evaluation_func)
+            total += log_likelihood
+            total_gradient += correct_expected - all_expected
+            print('log likelihood total after word problem: {} is {}'
+                  .format(i, total))
 
-        return total_gradient
+        return total, total_gradient
 
-    @staticmethod
-    def can_derive_correct_equations(derivation, correct_template_index,
+    @classmethod
+    def can_derive_correct_equations(cls, derivation, correct_template_index,
                                      correct_solutions):
         if derivation.template_index != correct_template_index:
             return False
 
-        solutions = derivation.solve()
-        usable_solutions = list()
-        pending_solutions = 0
-        for s in solutions:
-            try:
-                usable_solutions.append(float(s))
-            except TypeError:
-                pending_solutions += 1
-
         # Need to have all the correct solutions.
         # Some problems involve equations with multiple
         # unknowns, but the quesition only wants to know the
         # value of one of them. So having extra values is fine.
-        correct_solutions = correct_solutions[:]
-        for s in correct_solutions:
-            if s not in usable_solutions:
-                if pending_solutions == 0:
-                    return False
-                pending_solutions -= 1
-            else:
-                usable_solutions.remove(s)
-
-        return True
+        unmatched, pending = cls.unmatched_solutions(derivation,
+                                                     correct_solutions)
+        return len(unmatched) <= pending
+
+    @classmethod
+    def unmatched_solutions(cls, derivation, correct_solutions):
+        '''Returns the correct solutions which no solved unknown matches
+           and the number of unknowns which are not solved yet.
+           Each derivation starts from its parent's result and only
+           checks the unknowns its last number slot completed'''
+        if derivation.validation is not None:
+            return derivation.validation
+
+        if derivation.parent is None:
+            unmatched = list(correct_solutions)
+            pending = len(derivation.template.compiled_solution())
+        else:
+            unmatched, pending = cls.unmatched_solutions(derivation.parent,
+                                                         correct_solutions)
+
+        newly_solved = derivation.newly_solved_unknowns()
+        if newly_solved:
+            solution = derivation.solve()
+            unmatched = list(unmatched)
+            for i in newly_solved:
+                # Unknowns without a finite value stay pending
+                if solution[i] is None:
+                    continue
+
+                pending -= 1
+                if solution[i] in unmatched:
+                    unmatched.remove(solution[i])
+
+        derivation.validation = (unmatched, pending)
+        return derivation.validation
 
     def solve(self, wp):
 
-        def score_func(d):
-            return self.probability_of_derivation(d)
-
         def final_eval_func(derivations):
+            if len(derivations) == 0:
+                return list()
+
+            solve_complete_derivations(derivations)
+            # Shifting every log score by the same amount keeps
+            # the relative probabilities and cannot overflow
+            log_scores = self.score_derivations(derivations)
+            probs = numpy.exp(log_scores - log_scores.max())
             total_probs = defaultdict(int)
-            for d in derivations:
+            for d, prob in zip(derivations, probs):
                 sol = d.solve()
-                total_probs[tuple(sorted(sol))] += score_func(d)
+                total_probs[tuple(sorted(sol))] += prob
 
             best_prob = max(total_probs.values())
             for sol, prob in total_probs.iteritems():
@@ -159,8 +174,9 @@ class Classifier(object):
 
             return None
 
-        solution = beam_search(wp, self.unique_templates, score_func,
-                               lambda d: True, final_eval_func)
+        solution = beam_search(wp, self.unique_templates,
+                               self.score_derivations, lambda d: True,
+                               final_eval_func)
 
         correct_sol = wp.labeled_example.solutions[:]
         correct = True
@@ -1,33 +1,100 @@
 import json
-from copy import deepcopy
+from collections import defaultdict
+
+import numpy
 
 
 class Derivation(object):
-    def __init__(self, unknown_map, number_map, template,
-                 template_index, word_problem, nouns, numbers):
-        self.unknown_map = unknown_map
-        self.number_map = number_map
+    '''A possibly partial assignment of a template's slots.
+
+       numbers and nouns are the word problem's tables and are shared
+       by every derivation of the problem. number_slots and
+       unknown_slots are the template's slots in the order they are
+       filled. assignments holds an index into numbers for each filled
+       number slot followed by an index into nouns for each filled
+       unknown slot. used_numbers is a bitmask of the indices into
+       numbers which are already assigned. Children share everything
+       except the assignments tuple and the mask. parent is the
+       derivation this one was filled in from, if any'''
+    __slots__ = ('template', 'template_index', 'word_problem',
+                 'nouns', 'numbers', 'number_slots', 'unknown_slots',
+                 'assignments', 'used_numbers', 'parent',
+                 'solution', 'validation', 'features', 'log_score',
+                 'score_version')
+
+    def __init__(self, template, template_index, word_problem,
+                 nouns, numbers, number_slots, unknown_slots,
+                 assignments, used_numbers, parent=None):
         self.template = template
         self.template_index = template_index
         self.word_problem = word_problem
         self.nouns = nouns
         self.numbers = numbers
-
-    def copy(self):
-        return Derivation(deepcopy(self.unknown_map),
-                          deepcopy(self.number_map),
-                          self.template, self.template_index,
-                          self.word_problem, self.nouns,
-                          deepcopy(self.numbers))
+        self.number_slots = number_slots
+        self.unknown_slots = unknown_slots
+        self.assignments = assignments
+        self.used_numbers = used_numbers
+        self.parent = parent
+        # Filled in lazily since a derivation is solved, featurized
+        # and scored several times during one beam search
+        self.solution = None
+        self.validation = None
+        self.features = None
+        self.log_score = None
+        self.score_version = None
+
+    def child(self, index, used_numbers):
+        return Derivation(self.template, self.template_index,
+                          self.word_problem, self.nouns, self.numbers,
+                          self.number_slots, self.unknown_slots,
+                          self.assignments + (index,), used_numbers,
+                          self)
+
+    @property
+    def number_map(self):
+        filled = self.assignments[:len(self.number_slots)]
+        number_map = {s: None for s in self.number_slots}
+        for slot, i in zip(self.number_slots, filled):
+            number_map[slot] = self.numbers[i]
+
+        return number_map
+
+    @property
+    def unknown_map(self):
+        filled = self.assignments[len(self.number_slots):]
+        unknown_map = {s: None for s in self.unknown_slots}
+        for slot, i in zip(self.unknown_slots, filled):
+            unknown_map[slot] = self.nouns[i]
+
+        return unknown_map
+
+    def slot_locations(self):
+        '''Maps the name of each slot to the number or noun
+           assigned to it or None if it is not filled'''
+        locations = {str(s): v for s, v in self.number_map.iteritems()}
+        for s, v in self.unknown_map.iteritems():
+            locations[str(s)] = v
+
+        return locations
+
+    def number_values(self):
+        '''Maps each filled number slot to its value'''
+        return {slot: self.numbers[i]['number']
+                for slot, i in zip(self.number_slots, self.assignments)}
+
+    def remaining_numbers(self):
+        return [n for i, n in enumerate(self.numbers)
+                if not self.used_numbers & (1 << i)]
 
     def all_unknowns_filled(self):
-        return not any(v is None for v in self.unknown_map.itervalues())
+        return self.is_complete()
 
     def all_numbers_filled(self):
-        return not any(v is None for v in self.number_map.itervalues())
+        return len(self.assignments) >= len(self.number_slots)
 
     def is_complete(self):
-        return self.all_unknowns_filled() and self.all_numbers_filled()
+        return (len(self.assignments)
+                == len(self.number_slots) + len(self.unknown_slots))
 
     def all_ways_to_fill_next_slot(self):
         if not self.all_numbers_filled():
@@ -39,43 +106,46 @@ class Derivation(object):
         return None
 
     def all_ways_to_fill_next_number(self):
-        not_assigned = [s for s in self.number_map
-                        if self.number_map[s] is None]
-        next_number_slot = sorted(not_assigned, key=str)[0]
-
-        derivations = list()
-        for number in self.numbers:
-            derivation = self.copy()
-            derivation.number_map[next_number_slot] = number
-            derivation.numbers.remove(number)
-            derivations.append(derivation)
-
-        return derivations
+        for i in range(len(self.numbers)):
+            bit = 1 << i
+            if not self.used_numbers & bit:
+                yield self.child(i, self.used_numbers | bit)
 
     def all_ways_to_fill_next_unknown(self):
-        not_assigned = [s for s in self.unknown_map
-                        if self.unknown_map[s] is None]
-        next_unknown_slot = sorted(not_assigned, key=str)[0]
+        for i in range(len(self.nouns)):
+            yield self.child(i, self.used_numbers)
 
-        derivations = list()
-        for noun in self.nouns:
-            derivation = self.copy()
-            derivation.unknown_map[next_unknown_slot] = noun
-            derivations.append(derivation)
+    def newly_solved_unknowns(self):
+        '''Indices into the solution of the unknowns which could not
+           be solved for the parent but can be solved for this one'''
+        filled = len(self.assignments)
+        if filled > len(self.number_slots):
+            return list()
 
-        return derivations
+        return self.template.unknowns_completed_at(self.number_slots)[filled]
 
     def solve(self):
-        solutions = list()
-        for equation in self.template.solution.itervalues():
-            subs = {k: v['number'] for k, v in self.number_map.iteritems()
-                    if v is not None}
-            try:
-                solutions.append(float(equation.full.xreplace(subs)))
-            except TypeError:
-                solutions.append(None)
+        if self.solution is not None:
+            return self.solution
+
+        if self.parent is None or self.parent.solution is None:
+            self.solution = self.template.solve_numbers(
+                self.number_values())
+            return self.solution
+
+        # Only the unknowns completed by the last number slot can
+        # differ from the parent's solution
+        newly_solved = self.newly_solved_unknowns()
+        if not newly_solved:
+            self.solution = self.parent.solution
+            return self.solution
+
+        numbers = self.number_values()
+        self.solution = list(self.parent.solution)
+        for i in newly_solved:
+            self.solution[i] = self.template.solve_unknown(i, numbers)
 
-        return solutions
+        return self.solution
 
     def __str__(self):
         return json.dumps(self.to_json())
@@ -89,7 +159,39 @@ class Derivation(object):
                 'template_index': self.template_index,
                 'word_problem': self.word_problem.to_json(),
                 'nouns': self.nouns,
-                'numbers': self.numbers}
+                'numbers': self.remaining_numbers()}
+
+
+def solve_template_derivations(template, derivations):
+    '''Solves complete derivations which all use the given template
+       with a single vectorized call. Returns the matrix of solutions
+       and the mask of finite values from Template.solve_number_matrix'''
+    slots = template.number_slots()
+    rows = list()
+    for d in derivations:
+        values = d.number_values()
+        rows.append([values[s] for s in slots])
+
+    values = numpy.array(rows, dtype=float)
+    values = values.reshape((len(derivations), len(slots)))
+    return template.solve_number_matrix(values)
+
+
+def solve_complete_derivations(derivations):
+    '''Fills in the cached solution of every complete derivation
+       with one call to solve_template_derivations per template'''
+    by_template = defaultdict(list)
+    for d in derivations:
+        if d.solution is None and d.is_complete():
+            by_template[d.template_index].append(d)
+
+    for same_template in by_template.itervalues():
+        template = same_template[0].template
+        solutions, valid = solve_template_derivations(template,
+                                                      same_template)
+        for d, row, row_valid in zip(same_template, solutions, valid):
+            d.solution = [float(v) if ok else None
+                          for v, ok in zip(row, row_valid)]
 
 
 def initialize_partial_derivations_for_all_templates(wp, templates):
@@ -101,14 +203,15 @@ def initialize_partial_derivations_for_all_templates(wp, templates):
         for eq in template.equations:
             slots.update(eq.symbols)
 
-        unknown_slots = [s for s in slots if 'u_' in str(s)]
-        number_slots = [s for s in slots if 'n_' in str(s)]
-        unknown_map = {u: None for u in unknown_slots}
-        number_map = {n: None for n in number_slots}
+        # Slots are filled in order of their names
+        unknown_slots = tuple(sorted((s for s in slots if 'u_' in str(s)),
+                                     key=str))
+        number_slots = tuple(sorted((s for s in slots if 'n_' in str(s)),
+                                    key=str))
 
-        partial_derivations.append(Derivation(unknown_map, number_map,
-                                              template, template_index,
-                                              wp, nouns,
-                                              deepcopy(numbers)))
+        partial_derivations.append(Derivation(template, template_index,
+                                              wp, nouns, numbers,
+                                              number_slots, unknown_slots,
+                                              tuple(), 0))
 
     return partial_derivations
@@ -4,6 +4,7 @@ from sympy.parsing.sympy_parser import parse_expr
 from sympy import Symbol
 
 from util import try_parse_float
+from equation_parser import EquationParser
 
 
 class Equation(object):
@@ -33,7 +34,9 @@ class Equation(object):
     @classmethod
     def parse_side(cls, s):
         s = cls.clean(s)
-        base = parse_expr(s, evaluate=False)
+        base = EquationParser.parse(s)
+        if base is None:
+            base = parse_expr(s, evaluate=False)
         return cls.numbers_to_symbols(base).expand()
 
     @classmethod
@@ -0,0 +1,161 @@
+import re
+from keyword import iskeyword
+
+import sympy
+from sympy import Add, Mul, Pow, Integer, Float, Symbol
+
+# The equations only use numbers, variables, + - * /, parentheses
+# and unary signs. Anything else is left to sympy's parse_expr.
+TOKEN_PATTERN = re.compile(r'[ \t]*(?:(?P<number>(?:\d+\.?\d*|\.\d+)'
+                           r'(?:[eE][+-]?\d+)?)'
+                           r'|(?P<name>[A-Za-z_]\w*)'
+                           r'|(?P<op>[-+*/()]))')
+
+# parse_expr turns these names into sympy objects instead of symbols
+SYMPY_NAMES = set(dir(sympy))
+
+
+class ParseError(Exception):
+    pass
+
+
+class EquationParser(object):
+    '''Tokenizer and recursive descent parser for one side of an
+       equation. It builds exactly the expression parse_expr gives with
+       evaluate=False: numbers become Integer or Float, a - b is
+       Add(a, -b), a / b is Mul(a, Pow(b, -1)) and directly nested sums
+       and products are flattened into one Add or Mul'''
+    def __init__(self, s):
+        self.tokens = self.tokenize(s)
+        self.position = 0
+
+    @classmethod
+    def parse(cls, s):
+        '''Returns None if s is outside of the supported grammar'''
+        try:
+            parser = cls(s)
+            node = parser.parse_sum()
+            if parser.peek() is not None:
+                raise ParseError('unexpected {}'.format(parser.peek()))
+        except ParseError:
+            return None
+
+        return cls.build(node)
+
+    @staticmethod
+    def tokenize(s):
+        s = s.strip()
+        tokens = list()
+        position = 0
+        end = len(s)
+        while position < end:
+            match = TOKEN_PATTERN.match(s, position)
+            if match is None:
+                raise ParseError('no token at {} in {}'.format(position, s))
+
+            position = match.end()
+            for kind in ['number', 'name', 'op']:
+                value = match.group(kind)
+                if value is not None:
+                    tokens.append((kind, value))
+
+        return tokens
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+
+        return None
+
+    def next_token(self):
+        token = self.peek()
+        if token is None:
+            raise ParseError('unexpected end')
+
+        self.position += 1
+        return token
+
+    # Nodes are ('Add', args) and ('Mul', args) for operator calls,
+    # which are flattened into their parent call of the same kind,
+    # and ('value', expression) for everything else
+    @classmethod
+    def call_args(cls, node, kind):
+        if node[0] == kind:
+            return node[1]
+
+        return [cls.build(node)]
+
+    @staticmethod
+    def build(node):
+        if node[0] == 'Add':
+            return Add(*node[1], evaluate=False)
+
+        if node[0] == 'Mul':
+            return Mul(*node[1], evaluate=False)
+
+        return node[1]
+
+    def parse_sum(self):
+        node = self.parse_product()
+        while self.peek() in [('op', '+'), ('op', '-')]:
+            _, op = self.next_token()
+            right = self.parse_product()
+            if op == '-':
+                right = ('value', -self.build(right))
+
+            node = ('Add', self.call_args(node, 'Add')
+                    + self.call_args(right, 'Add'))
+
+        return node
+
+    def parse_product(self):
+        node = self.parse_factor()
+        while self.peek() in [('op', '*'), ('op', '/')]:
+            _, op = self.next_token()
+            right = self.parse_factor()
+            if op == '/':
+                right = ('value', Pow(self.build(right), -1, evaluate=False))
+
+            node = ('Mul', self.call_args(node, 'Mul')
+                    + self.call_args(right, 'Mul'))
+
+        return node
+
+    def parse_factor(self):
+        if self.peek() == ('op', '-'):
+            self.next_token()
+            return ('value', -self.build(self.parse_factor()))
+
+        if self.peek() == ('op', '+'):
+            self.next_token()
+            return ('value', +self.build(self.parse_factor()))
+
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.next_token()
+        if kind == 'op':
+            if value != '(':
+                raise ParseError('unexpected {}'.format(value))
+
+            node = self.parse_sum()
+            if self.next_token() != ('op', ')'):
+                raise ParseError('unbalanced parentheses')
+
+            return node
+
+        if kind == 'number':
+            if '.' in value or 'e' in value or 'E' in value:
+                return ('value', Float(value))
+
+            # Python 2 reads a leading zero as octal
+            if len(value) > 1 and value[0] == '0':
+                raise ParseError('octal literal {}'.format(value))
+
+            return ('value', Integer(value))
+
+        if (iskeyword(value) or value in ['True', 'False', 'None']
+                or value in SYMPY_NAMES):
+            raise ParseError('reserved name {}'.format(value))
+
+        return ('value', Symbol(value))
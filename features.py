@@ -1,6 +1,8 @@
+import itertools
 import json
 
-from sympy import Symbol
+import numpy
+from scipy.sparse import csr_matrix
 
 
 class FeatureExtractor(object):
@@ -17,12 +19,14 @@ class FeatureExtractor(object):
         self.slot_pair_signatures = signatures['pair']
 
         self.ordered_features = self.order_all_features()
+        self.shared_features, self.template_features = (
+            self.index_applicable_features())
 
     @staticmethod
     def find_unigrams(word_problems):
         unigrams = set()
         for wp in word_problems:
-            unigrams.update(set(wp.nlp.words()))
+            unigrams.update(wp.nlp.word_set())
 
         return sorted(unigrams)
 
@@ -30,7 +34,7 @@ class FeatureExtractor(object):
     def find_bigrams(word_problems):
         bigrams = set()
         for wp in word_problems:
-            bigrams.update(set(wp.nlp.bigrams()))
+            bigrams.update(wp.nlp.bigram_set())
 
         return sorted(bigrams)
 
@@ -38,7 +42,7 @@ class FeatureExtractor(object):
     def find_lemmas(word_problems):
         lemmas = set()
         for wp in word_problems:
-            lemmas.update(set(wp.nlp.lemmas()))
+            lemmas.update(wp.nlp.lemma_set())
 
         return sorted(lemmas)
 
@@ -123,36 +127,56 @@ class FeatureExtractor(object):
                 + self.single_slot_features()
                 + self.slot_pair_features())
 
-    def extract(self, derivation):
-        prepared = PreparedDerivation(derivation)
-        instance = [f.indicator(prepared) for f in self.ordered_features]
-        return Features(self.ordered_features, instance)
+    def index_applicable_features(self):
+        '''Splits the feature indices into those which can be True
+           for any derivation and those which can only be True for
+           derivations of one template'''
+        shared = list()
+        by_template = {i: list() for i in range(self.template_count)}
+        for i, f in enumerate(self.ordered_features):
+            if f.template_index is None:
+                shared.append(i)
+            else:
+                by_template[f.template_index].append(i)
 
+        return shared, by_template
 
-class PreparedDerivation(object):
-    '''Extracts and stores the relevant info for determining features.
-       This makes it easy to apply each feature indicator function'''
-    def __init__(self, derivation):
-        self.derivation = derivation
-        self.unigrams = derivation.word_problem.nlp.words()
-        self.bigrams = derivation.word_problem.nlp.bigrams()
-        self.template_index = derivation.template_index
-        self.solution = derivation.solve()
-        self.questions = derivation.word_problem.nlp.questions()
-        self.commands = derivation.word_problem.nlp.commands()
-        self.ques_and_command_objects = self.initialize_sentence_objects()
+    def extract(self, derivation):
+        prepared = PreparedDerivation(derivation)
+        candidates = itertools.chain(
+            self.shared_features,
+            self.template_features[derivation.template_index])
+        active = [i for i in candidates
+                  if self.ordered_features[i].indicator(prepared)]
+        return Features(self.ordered_features,
+                        numpy.array(sorted(active), dtype=int))
+
+
+class PreparedWordProblem(object):
+    '''The info for determining features which only depends on the
+       word problem. It is computed once per word problem and shared
+       by all of the derivations for that problem'''
+    def __init__(self, word_problem):
+        nlp = word_problem.nlp
+        self.unigrams = nlp.word_set()
+        self.bigrams = nlp.bigram_set()
+        self.questions = nlp.questions()
+        self.commands = nlp.commands()
+        self.ques_and_command_objects = self.initialize_sentence_objects(
+            nlp)
         self.ques_and_command_lemmas = {t.lemma
                                         for t in self.ques_and_command_objects
                                         .itervalues()}
-        self.phrases = {i: s.phrases()
-                        for i, s in
-                        enumerate(self.derivation.word_problem.nlp.sentences)}
-        self.constants = {i: e.constants()
-                          for i, e in enumerate(derivation.template.equations)}
-        self.single_slots = self.initialize_single_slots()
-        self.slot_pairs = self.initialize_slot_pairs()
+        self.sentences = nlp.sentences
+
+    @classmethod
+    def for_word_problem(cls, word_problem):
+        if word_problem.prepared is None:
+            word_problem.prepared = cls(word_problem)
 
-    def initialize_sentence_objects(self):
+        return word_problem.prepared
+
+    def initialize_sentence_objects(self, nlp):
         sentences = dict()
         for i, s in self.questions.iteritems():
             sentences[i] = s
@@ -163,12 +187,34 @@ class PreparedDerivation(object):
         objects = dict()
         for s_index, s in sentences.iteritems():
             _, t_index = s.object_of_sentence()
-            objects[(s_index, t_index)] = (self.derivation.word_problem.nlp
-                                           .sentences[s_index]
+            objects[(s_index, t_index)] = (nlp.sentences[s_index]
                                            .tokens[t_index])
 
         return objects
 
+
+class PreparedDerivation(object):
+    '''Extracts and stores the relevant info for determining features.
+       This makes it easy to apply each feature indicator function'''
+    def __init__(self, derivation):
+        self.derivation = derivation
+        prepared_wp = PreparedWordProblem.for_word_problem(
+            derivation.word_problem)
+        self.unigrams = prepared_wp.unigrams
+        self.bigrams = prepared_wp.bigrams
+        self.template_index = derivation.template_index
+        self.slot_locations = derivation.slot_locations()
+        self.solution = derivation.solve()
+        self.questions = prepared_wp.questions
+        self.commands = prepared_wp.commands
+        self.ques_and_command_objects = prepared_wp.ques_and_command_objects
+        self.ques_and_command_lemmas = prepared_wp.ques_and_command_lemmas
+        self.sentences = prepared_wp.sentences
+        self.constants = {i: e.constants()
+                          for i, e in enumerate(derivation.template.equations)}
+        self.single_slots = self.initialize_single_slots()
+        self.slot_pairs = self.initialize_slot_pairs()
+
     def initialize_single_slots(self):
         single_slots = dict()
         template = self.derivation.template
@@ -212,8 +258,7 @@ class PreparedDerivation(object):
                 or signature.symbol[0] != 'n'):
             return None
 
-        sym = Symbol(signature.symbol)
-        details = self.derivation.number_map[sym]
+        details = self.slot_locations[signature.symbol]
         if details is None:
             return None
 
@@ -223,11 +268,7 @@ class PreparedDerivation(object):
         if self.derivation.template_index != signature.template_index:
             return None
 
-        sym = Symbol(signature.symbol)
-        if signature.symbol[0] == 'n':
-            return self.derivation.number_map[sym]
-        else:
-            return self.derivation.unknown_map[sym]
+        return self.slot_locations[signature.symbol]
 
     def sentence_index_for_slot(self, signature):
         loc = self.location_for_slot(signature)
@@ -250,16 +291,12 @@ class PreparedDerivation(object):
     # TODO(Eric): Using the "parse tree" instead of linear token distance
     #             would be a better definition of "close"
     def closest_noun_token_from_indices(self, sentence_index, token_index):
-        nlp = self.derivation.word_problem.nlp
-        sentence = nlp.sentences[sentence_index]
-        tokens = sentence.tokens
-        search_order = sorted(range(len(tokens)),
-                              key=lambda n: abs(token_index - n))
-        for i in search_order:
-            if tokens[i].pos in ['NN', 'NNS']:
-                return (sentence_index, token_index, tokens[i])
+        sentence = self.sentences[sentence_index]
+        noun_index = sentence.nearest_noun_indices()[token_index]
+        if noun_index is None:
+            raise Exception('no noun in: {}'.format(sentence.as_text()))
 
-        raise Exception('no noun in: {}'.format(sentence.as_text()))
+        return (sentence_index, token_index, sentence.tokens[noun_index])
 
 
 class SingleSlotData(object):
@@ -297,22 +334,44 @@ class SlotPairData(object):
 
 
 class Features(object):
-    def __init__(self, features, instance):
+    '''A sparse feature vector. Almost every feature is False
+       for any one derivation so only the indices into
+       features of those which are True are stored'''
+    def __init__(self, features, active):
         self.features = features
-        self.instance = instance
+        self.active = active
+
+    @staticmethod
+    def matrix(features_list, feature_count):
+        '''Stacks feature vectors into a sparse matrix
+           with a row per feature vector'''
+        lengths = [len(f.active) for f in features_list]
+        indptr = numpy.concatenate(([0], numpy.cumsum(lengths, dtype=int)))
+        if features_list:
+            indices = numpy.concatenate([f.active for f in features_list])
+        else:
+            indices = numpy.array(list(), dtype=int)
+
+        data = numpy.ones(len(indices))
+        return csr_matrix((data, indices, indptr),
+                          shape=(len(features_list), feature_count))
 
     def __str__(self):
         return json.dumps(self.to_json())
 
     def to_json(self):
-        return {f.name: self.instance[i]
+        active = set(self.active)
+        return {f.name: i in active
                 for i, f in enumerate(self.features)}
 
 
 class Feature(object):
-    def __init__(self, name, indicator):
+    '''template_index is set for features which can only be True
+       for derivations of that template'''
+    def __init__(self, name, indicator, template_index=None):
         self.name = name
         self.indicator = indicator
+        self.template_index = template_index
 
     @staticmethod
     def from_unigram(unigram):
@@ -327,7 +386,8 @@ class Feature(object):
     @staticmethod
     def from_template_index(index):
         return Feature('is template {}'.format(index),
-                       lambda prepared: prepared.template_index == index)
+                       lambda prepared: prepared.template_index == index,
+                       index)
 
     @staticmethod
     def solution_all_integer():
@@ -354,7 +414,8 @@ class Feature(object):
 
             return slot_data.number == 1
 
-        return Feature('{} is 1'.format(slot_signature), check)
+        return Feature('{} is 1'.format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_is_two(slot_signature):
@@ -365,7 +426,8 @@ class Feature(object):
 
             return slot_data.number == 2
 
-        return Feature('{} is 2'.format(slot_signature), check)
+        return Feature('{} is 2'.format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_is_in_question_or_command(slot_signature):
@@ -378,7 +440,8 @@ class Feature(object):
                     or slot_data.sentence in prepared.commands)
 
         return Feature('{} is in question or command'
-                       .format(slot_signature), check)
+                       .format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_is_ques_or_command_object(slot_signature):
@@ -391,7 +454,8 @@ class Feature(object):
             return location in prepared.ques_and_command_objects
 
         return Feature('{} is question or command object'
-                       .format(slot_signature), check)
+                       .format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_has_lemma_of_ques_or_command_object(slot_signature):
@@ -403,7 +467,8 @@ class Feature(object):
             return slot_data.lemma in prepared.ques_and_command_lemmas
 
         return Feature('{} has lemma of question or command object'
-                       .format(slot_signature), check)
+                       .format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_lemma_near_constant(slot_signature, lemma, constant):
@@ -420,7 +485,8 @@ class Feature(object):
                         slot_signature.equation_index])
 
         return Feature('{} has lemma {} and near constant {}'
-                       .format(slot_signature, lemma, constant), check)
+                       .format(slot_signature, lemma, constant), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_pair_in_same_sentence(slot_signature):
@@ -433,7 +499,8 @@ class Feature(object):
                     and slot_data.slot1_data.sentence
                     == slot_data.slot2_data.sentence)
 
-        return Feature('{} in same sentence'.format(slot_signature), check)
+        return Feature('{} in same sentence'.format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_pair_are_same_token(slot_signature):
@@ -449,7 +516,8 @@ class Feature(object):
                     and s1.sentence == s2.sentence
                     and s1.token == s2.token)
 
-        return Feature('{} are same token'.format(slot_signature), check)
+        return Feature('{} are same token'.format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_pair_have_same_lemma(slot_signature):
@@ -463,7 +531,8 @@ class Feature(object):
             return (s1 is not None
                     and s1.lemma == s2.lemma)
 
-        return Feature('{} are same lemma'.format(slot_signature), check)
+        return Feature('{} are same lemma'.format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_pair_are_same_number(slot_signature):
@@ -478,7 +547,8 @@ class Feature(object):
                     and s2.number is not None
                     and s1.number == s2.number)
 
-        return Feature('{} are same number'.format(slot_signature), check)
+        return Feature('{} are same number'.format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_pair_a_greater_than_b(slot_signature):
@@ -493,7 +563,8 @@ class Feature(object):
                     and s2.number is not None
                     and s1.number > s2.number)
 
-        return Feature('{} a > b'.format(slot_signature), check)
+        return Feature('{} a > b'.format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_pair_a_less_than_b(slot_signature):
@@ -508,7 +579,8 @@ class Feature(object):
                     and s2.number is not None
                     and s1.number < s2.number)
 
-        return Feature('{} a < b'.format(slot_signature), check)
+        return Feature('{} a < b'.format(slot_signature), check,
+                       slot_signature.template_index)
 
     @staticmethod
     def slot_pair_in_same_phrase(slot_signature):
@@ -521,9 +593,8 @@ class Feature(object):
             s2 = slot_data.slot2_data
             if s1.sentence is None or s1.sentence != s2.sentence:
                 return False
-            s = s1.sentence
-            t1 = s1.token
-            t2 = s2.token
-            return any((t1 in p and t2 in p) for p in prepared.phrases[s])
+            return prepared.sentences[s1.sentence].in_same_phrase(s1.token,
+                                                                  s2.token)
 
-        return Feature('{} in same phrase'.format(slot_signature), check)
+        return Feature('{} in same phrase'.format(slot_signature), check,
+                       slot_signature.template_index)
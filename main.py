@@ -1,20 +1,24 @@
 import argparse
 import json
+from collections import defaultdict
+from multiprocessing import Pool
 
 from labeled_example import LabeledExample
 from nlp import NLP
 from word_problem import WordProblem
 from template import Template
-from features import FeatureExtractor
-from optimize import optimize_parameters
-from derivation import initialize_partial_derivations_for_all_templates
+from template_cache import TemplateCache
+from nlp_cache import NLPCache
+
+# features, optimize and derivation pull in numpy and scipy so
+# they are imported only by the actions which train or extract features
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('action', choices=['print', 'find-template-set',
-                                           'count-unique', 'extract-features',
-                                           'fold'],
+                                           'add-templates', 'count-unique',
+                                           'extract-features', 'fold'],
                         help='What to do with the data')
     parser.add_argument('-j', '--json', type=str,
                         default='data/questions.json',
@@ -41,25 +45,53 @@ def main():
     parser.add_argument('-fo', '--foldoutput', type=str,
                         default='{}_folds_test_{}.json',
                         help='template for file name of fold results')
+    parser.add_argument('-w', '--workers', type=int,
+                        default=1,
+                        help='number of processes for template extraction '
+                             'and training')
+    parser.add_argument('-c', '--cache', type=str,
+                        default='template_cache',
+                        help='directory to cache extracted templates, '
+                             'empty to disable')
+    parser.add_argument('-nc', '--nlpcache', type=str,
+                        default='nlp_cache.bin',
+                        help='file to cache the NLP parses of all problems, '
+                             'empty to disable')
     args = parser.parse_args()
 
     if args.action == 'print':
-        call_print(args.json, args.index, args.nlp)
+        call_print(args.json, args.index, args.nlp, args.cache,
+                   args.nlpcache)
 
     if args.action == 'find-template-set':
-        call_find_template_set(args.json, args.nlp, args.templates)
+        call_find_template_set(args.json, args.nlp, args.templates,
+                               args.cache, args.workers)
+
+    if args.action == 'add-templates':
+        call_add_templates(args.json, args.unique, args.nlp, args.templates,
+                           args.cache, args.workers)
 
     if args.action == 'count-unique':
-        call_count_unique(args.json, args.unique, args.nlp)
+        call_count_unique(args.json, args.unique, args.nlp, args.cache)
 
     if args.action == 'extract-features':
         call_extract_features(args.json, args.nlp, args.templates,
-                              args.parameters)
+                              args.parameters, args.nlpcache)
 
     if args.action == 'fold':
         call_fold(args.testfold, args.numfolds, args.foldoutput,
                   args.json, args.nlp, args.templates,
-                  args.parameters)
+                  args.parameters, args.workers, args.nlpcache)
+
+
+def read_natural_language(arg_nlp, arg_nlp_cache, indices):
+    if arg_nlp_cache:
+        natural_language = NLPCache(arg_nlp_cache).read_all(arg_nlp, indices)
+    else:
+        natural_language = {i: NLP.read(arg_nlp, i) for i in indices}
+
+    NLP.find_numbers_for_corpus(natural_language.values())
+    return natural_language
 
 
 def make_fold_indices(num_folds, total):
@@ -80,10 +112,14 @@ def make_fold_indices(num_folds, total):
 
 
 def call_fold(arg_testfold, arg_numfolds, arg_foldoutput,
-              arg_json, arg_nlp, arg_templates, arg_parameters):
+              arg_json, arg_nlp, arg_templates, arg_parameters,
+              arg_workers, arg_nlp_cache):
+    from features import FeatureExtractor
+    from optimize import optimize_parameters
+
     examples = LabeledExample.read(arg_json)
     indices = [e.index for e in examples.itervalues()][:5]  # TODO just 5 for testing
-    natural_language = {i: NLP.read(arg_nlp, i) for i in indices}
+    natural_language = read_natural_language(arg_nlp, arg_nlp_cache, indices)
     word_problems = [WordProblem(examples[i], natural_language[i])
                      for i in indices]
 
@@ -93,13 +129,7 @@ def call_fold(arg_testfold, arg_numfolds, arg_foldoutput,
     for per_fold in fold_indices:
         train_indices.extend(per_fold)
 
-    with open(arg_templates, 'rt') as f_handle:
-        raw = f_handle.read()
-
-    parsed = json.loads(raw)
-    unique_templates = [Template.from_json(j) for j in parsed['templates']]
-    wp_template_map = {int(k): v
-                       for k, v in parsed['wp_template_map'].iteritems()}
+    unique_templates, wp_template_map = read_template_set(arg_templates)
 
     train_wps = [word_problems[i] for i in train_indices]
     train_templates_indices = list({wp_template_map[wp.labeled_example.index]
@@ -112,7 +142,8 @@ def call_fold(arg_testfold, arg_numfolds, arg_foldoutput,
 
     feature_extractor = FeatureExtractor(train_templates, train_wps)
     classifier = optimize_parameters(feature_extractor, train_wps,
-                                     train_templates, remap_templates)
+                                     train_templates, remap_templates,
+                                     arg_workers)
     with open(arg_parameters, 'wt') as f_handle:
         f_handle.write(json.dumps(classifier.to_json()))
 
@@ -123,18 +154,18 @@ def call_fold(arg_testfold, arg_numfolds, arg_foldoutput,
     print('{} correct out of {}'.format(correct, len(test_indices)))
 
 
-def call_extract_features(arg_json, arg_nlp, arg_templates, arg_parameters):
+def call_extract_features(arg_json, arg_nlp, arg_templates, arg_parameters,
+                          arg_nlp_cache):
+    from features import FeatureExtractor
+    from derivation import initialize_partial_derivations_for_all_templates
+
     examples = LabeledExample.read(arg_json)
     indices = [e.index for e in examples.itervalues()]
-    natural_language = {i: NLP.read(arg_nlp, i) for i in indices}
+    natural_language = read_natural_language(arg_nlp, arg_nlp_cache, indices)
     word_problems = [WordProblem(examples[i], natural_language[i])
                      for i in indices]
 
-    with open(arg_templates, 'rt') as f_handle:
-        raw = f_handle.read()
-
-    parsed = json.loads(raw)
-    unique_templates = [Template.from_json(j) for j in parsed['templates']]
+    unique_templates, _ = read_template_set(arg_templates)
     # TODO(Eric): using only 2 word problems for testing
     unique_templates = unique_templates[:2]
     word_problems = word_problems[:2]
@@ -144,41 +175,93 @@ def call_extract_features(arg_json, arg_nlp, arg_templates, arg_parameters):
         word_problems[0], unique_templates)
     derivation = derivations[0]
     while not derivation.is_complete():
-        derivation = derivation.all_ways_to_fill_next_slot()[0]
+        derivation = next(derivation.all_ways_to_fill_next_slot())
 
     print(feature_extractor.extract(derivation))
     print(derivation)
 
 
-def call_count_unique(arg_json, arg_unique, arg_nlp):
+def call_count_unique(arg_json, arg_unique, arg_nlp, arg_cache):
     examples = LabeledExample.read(arg_json)
-    templates = list()
-    for index in arg_unique:
-        example = examples[index]
-        natural_language = NLP.read(arg_nlp, index)
-        wp = WordProblem(example, natural_language)
-        templates.append(wp.extract_template())
+    templates = extract_templates([examples[i] for i in arg_unique],
+                                  arg_nlp, arg_cache, 1)
 
     print(len(set(templates)))
     print(json.dumps([t.to_json() for t in templates]))
 
 
-def call_find_template_set(arg_json, arg_nlp, arg_templates):
-    examples = LabeledExample.read(arg_json)
-    indices = [e.index for e in examples.itervalues()]
-    natural_language = {i: NLP.read(arg_nlp, i) for i in indices}
-    word_problems = [WordProblem(examples[i], natural_language[i])
-                     for i in indices]
-    templates = [wp.extract_template() for wp in word_problems]
+def extract_template_json(job):
+    '''Runs in a worker process so takes a single picklable
+       argument and returns the template in json form'''
+    arg_nlp, arg_cache, example = job
 
-    unique = list()
-    wp_template_map = dict()
-    for wp in word_problems:
-        template = wp.template
-        wp_index = wp.labeled_example.index
+    def extract():
+        natural_language = NLP.read(arg_nlp, example.index)
+        wp = WordProblem(example, natural_language)
+        return wp.extract_template().to_json()
+
+    if not arg_cache:
+        return extract()
+
+    cache = TemplateCache(arg_cache)
+    return cache.extract_template_json(example, arg_nlp, extract)
+
+
+def extract_templates(examples, arg_nlp, arg_cache, arg_workers):
+    # Templates always go through json so the output does not
+    # depend on the number of workers or on the cache
+    jobs = [(arg_nlp, arg_cache, example) for example in examples]
+    if arg_workers <= 1:
+        return [Template.from_json(extract_template_json(job))
+                for job in jobs]
+
+    pool = Pool(arg_workers)
+    try:
+        # map() keeps the input order so the template indices
+        # do not depend on which worker finishes first
+        chunk_size = max(1, len(jobs) // (4 * arg_workers))
+        template_jsons = pool.map(extract_template_json, jobs, chunk_size)
+    finally:
+        pool.close()
+        pool.join()
+
+    return [Template.from_json(j) for j in template_jsons]
+
+
+def read_template_set(arg_templates):
+    with open(arg_templates, 'rt') as f_handle:
+        raw = f_handle.read()
+
+    parsed = json.loads(raw)
+    unique_templates = [Template.from_json(j) for j in parsed['templates']]
+    wp_template_map = {int(k): v
+                       for k, v in parsed['wp_template_map'].iteritems()}
+    return unique_templates, wp_template_map
+
+
+def write_template_set(arg_templates, unique, wp_template_map):
+    with open(arg_templates, 'wt') as f_handle:
+        out_json = {'templates': [t.to_json() for t in unique],
+                    'wp_template_map': wp_template_map}
+        f_handle.write(json.dumps(out_json))
+
+
+def add_to_template_set(unique, wp_template_map, examples, templates):
+    '''Maps each example to the index of an equal template in unique.
+       Templates without a match are appended so existing
+       indices never change'''
+    # Only templates with the same canonical form can be equal
+    # so the expensive __eq__ is limited to those candidates
+    unique_by_form = defaultdict(list)
+    for unique_i, u in enumerate(unique):
+        unique_by_form[u.canonical_form()].append(unique_i)
+
+    for example, template in zip(examples, templates):
+        wp_index = example.index
         found_template = False
-        for unique_i, u in enumerate(unique):
-            if template == u:
+        candidates = unique_by_form[template.canonical_form()]
+        for unique_i in candidates:
+            if template == unique[unique_i]:
                 wp_template_map[wp_index] = unique_i
                 found_template = True
                 break
@@ -186,21 +269,51 @@ def call_find_template_set(arg_json, arg_nlp, arg_templates):
         if not found_template:
             unique.append(template)
             wp_template_map[wp_index] = len(unique) - 1
+            candidates.append(len(unique) - 1)
+
+
+def call_find_template_set(arg_json, arg_nlp, arg_templates, arg_cache,
+                           arg_workers):
+    examples = LabeledExample.read(arg_json)
+    ordered_examples = list(examples.itervalues())
+    templates = extract_templates(ordered_examples, arg_nlp, arg_cache,
+                                  arg_workers)
+
+    unique = list()
+    wp_template_map = dict()
+    add_to_template_set(unique, wp_template_map, ordered_examples, templates)
 
     print('{} total and {} unique templates'.format(len(templates),
                                                     len(unique)))
-    with open(arg_templates, 'wt') as f_handle:
-        out_json = {'templates': [t.to_json() for t in unique],
-                    'wp_template_map': wp_template_map}
-        f_handle.write(json.dumps(out_json))
+    write_template_set(arg_templates, unique, wp_template_map)
+
+
+def call_add_templates(arg_json, arg_unique, arg_nlp, arg_templates,
+                       arg_cache, arg_workers):
+    examples = LabeledExample.read(arg_json)
+    unique, wp_template_map = read_template_set(arg_templates)
+
+    new_examples = [examples[i] for i in arg_unique
+                    if i not in wp_template_map]
+    templates = extract_templates(new_examples, arg_nlp, arg_cache,
+                                  arg_workers)
+
+    previous_count = len(unique)
+    add_to_template_set(unique, wp_template_map, new_examples, templates)
+
+    print('{} new problems and {} new templates, {} unique templates'
+          .format(len(new_examples), len(unique) - previous_count,
+                  len(unique)))
+    write_template_set(arg_templates, unique, wp_template_map)
 
 
-def call_print(arg_json, arg_index, arg_nlp):
+def call_print(arg_json, arg_index, arg_nlp, arg_cache, arg_nlp_cache):
     examples = LabeledExample.read(arg_json)
     example = examples[arg_index]
-    natural_language = NLP.read(arg_nlp, arg_index)
+    natural_language = read_natural_language(arg_nlp, arg_nlp_cache,
+                                             [arg_index])[arg_index]
     wp = WordProblem(example, natural_language)
-    wp.extract_template()
+    wp.template = extract_templates([example], arg_nlp, arg_cache, 1)[0]
     print(wp)
     print('questions: {}'
           .format([(s.as_text(), s.object_of_sentence())
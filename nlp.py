@@ -2,17 +2,31 @@ import json
 import os
 import xml.etree.ElementTree as ET
 
-from text_to_int import text_to_int
-
-from util import try_parse_float
 from parse_tree import ParseTree
+from number_tokens import NumberRecognizer
 
 
 class NLP(object):
     FILE_FORMAT = 'question-{}.xml'
+    # Shared by every problem so each distinct token is only
+    # classified once per process
+    number_recognizer = NumberRecognizer()
 
     def __init__(self, sentences):
         self.sentences = sentences
+        # Each view of the sentences is computed on first use. Ordered
+        # views are tuples and membership views are frozensets so the
+        # shared results cannot be changed by a caller
+        self.cached_questions = None
+        self.cached_commands = None
+        self.cached_words = None
+        self.cached_word_set = None
+        self.cached_lemmas = None
+        self.cached_lemma_set = None
+        self.cached_bigrams = None
+        self.cached_bigram_set = None
+        self.cached_nouns = None
+        self.cached_numbers = None
 
     @classmethod
     def read(cls, parse_dir, i):
@@ -31,126 +45,101 @@ class NLP(object):
 
         return NLP(sentences)
 
-    # These number words are fair game to replace in the text
-    # since they are a natural language representation of numerical
-    # operation. 'Twice' is equivalent to '2.0 times'
-    # This is distinct from the case of 'problem constants' like
-    # 0.01 for percent (%) problems
-    @staticmethod
-    def try_parse_number_word(w):
-        number_word_map = {'twice': 2.0,
-                           'triple': 3.0,
-                           'half': 0.5,
-                           'thrice': 3.0,
-                           'double': 2.0}
-        special = number_word_map.get(w.lower())
-        if special is not None:
-            return special
-
-        try:
-            return float(text_to_int(w))
-        except:
-            return None
-
-    @staticmethod
-    def clean(s):
-        for c in ['<', '>']:
-            s = s.replace(c, '')
-
-        return s
+    @classmethod
+    def find_numbers_for_corpus(cls, nlps):
+        '''Classifies the distinct tokens of all the problems at once
+           before finding the numbers of each problem'''
+        cls.number_recognizer.classify_tokens(
+            t for nlp in nlps for s in nlp.sentences for t in s.tokens)
+        for nlp in nlps:
+            nlp.numbers()
 
     def questions(self):
-        return {i: s for i, s in enumerate(self.sentences) if s.is_question()}
+        if self.cached_questions is None:
+            self.cached_questions = {i: s for i, s in enumerate(self.sentences)
+                                     if s.is_question()}
+
+        return self.cached_questions
 
     def commands(self):
-        return {i: s for i, s in enumerate(self.sentences) if s.is_command()}
+        if self.cached_commands is None:
+            self.cached_commands = {i: s for i, s in enumerate(self.sentences)
+                                    if s.is_command()}
+
+        return self.cached_commands
 
     def words(self):
-        words = list()
-        for s in self.sentences:
-            for t in s.tokens:
-                words.append(t.word)
+        if self.cached_words is None:
+            self.cached_words = tuple(t.word for s in self.sentences
+                                      for t in s.tokens)
 
-        return words
+        return self.cached_words
+
+    def word_set(self):
+        if self.cached_word_set is None:
+            self.cached_word_set = frozenset(self.words())
+
+        return self.cached_word_set
 
     def lemmas(self):
-        lemmas = list()
-        for s in self.sentences:
-            for t in s.tokens:
-                lemmas.append(t.lemma)
+        if self.cached_lemmas is None:
+            self.cached_lemmas = tuple(t.lemma for s in self.sentences
+                                       for t in s.tokens)
+
+        return self.cached_lemmas
+
+    def lemma_set(self):
+        if self.cached_lemma_set is None:
+            self.cached_lemma_set = frozenset(self.lemmas())
 
-        return lemmas
+        return self.cached_lemma_set
 
     def bigrams(self):
-        bigrams = list()
-        for s in self.sentences:
-            count = len(s.tokens)
-            for i in range(count - 1):
-                bigrams.append((s.tokens[i].word, s.tokens[i + 1].word))
+        if self.cached_bigrams is None:
+            bigrams = list()
+            for s in self.sentences:
+                count = len(s.tokens)
+                for i in range(count - 1):
+                    bigrams.append((s.tokens[i].word, s.tokens[i + 1].word))
+
+            self.cached_bigrams = tuple(bigrams)
+
+        return self.cached_bigrams
+
+    def bigram_set(self):
+        if self.cached_bigram_set is None:
+            self.cached_bigram_set = frozenset(self.bigrams())
 
-        return bigrams
+        return self.cached_bigram_set
 
     def nouns(self):
-        nouns = list()
-        for s_index, s in enumerate(self.sentences):
-            for t_index, t in enumerate(s.tokens):
-                if t.pos in ['NN', 'NNS']:
-                    nouns.append({'noun': t.word,
-                                  'sentence': s_index,
-                                  'token': t_index})
+        if self.cached_nouns is None:
+            nouns = list()
+            for s_index, s in enumerate(self.sentences):
+                for t_index, t in enumerate(s.tokens):
+                    if t.pos in ['NN', 'NNS']:
+                        nouns.append({'noun': t.word,
+                                      'sentence': s_index,
+                                      'token': t_index})
+
+            self.cached_nouns = tuple(nouns)
 
-        return nouns
+        return self.cached_nouns
 
     def numbers(self):
-        tokens = list()
-        for s_index, s in enumerate(self.sentences):
-            for t_index, t in enumerate(s.tokens):
-                tokens.append((s_index, t_index, t))
+        if self.cached_numbers is None:
+            self.cached_numbers = tuple(self.find_numbers())
 
+        return self.cached_numbers
+
+    def find_numbers(self):
         numbers = list()
-        for s_index, t_index, t in tokens:
-
-            def append_number(number):
-                numbers.append({'number': abs(number),
-                                'sentence': s_index,
-                                'token': t_index})
-
-            from_number_word = self.try_parse_number_word(t.word)
-            if from_number_word is not None:
-                append_number(from_number_word)
-                continue
-
-            from_word = try_parse_float(t.word)
-            if from_word is not None:
-                append_number(from_word)
-                continue
-
-            if '-' in t.word:
-                for part in t.word.split('-'):
-                    from_split = try_parse_float(part)
-                    if from_split is not None:
-                        append_number(from_split)
-                        continue
-                    from_split_word = self.try_parse_number_word(part)
-                    if from_split_word is not None:
-                        append_number(from_split_word)
-                        continue
-
-            # In question 2189 there is a blank in the text '___'
-            # which is interpreted as a NUMBER but with no value
-            if t.ner == 'NUMBER' and t.normalized_ner is not None:
-                cleaned = self.clean(t.normalized_ner)
-                from_number_ner = try_parse_float(cleaned)
-                if from_number_ner is not None:
-                    append_number(from_number_ner)
-                    continue
-
-            if t.ner == 'MONEY':
-                no_dollar_sign = t.normalized_ner.strip('$')
-                from_money_ner = try_parse_float(no_dollar_sign)
-                if from_money_ner is not None:
-                    append_number(from_money_ner)
-                    continue
+        for s_index, s in enumerate(self.sentences):
+            for t_index, t in enumerate(s.tokens):
+                for number in self.number_recognizer.token_numbers(t):
+                    numbers.append({'number': number,
+                                    'sentence': s_index,
+                                    'token': t_index})
 
         # Was seeing '4.0 dollars' being counted as 2 occurences of 4.0
         last_s = last_t = last_n = None
@@ -180,6 +169,15 @@ class Sentence(object):
         self.tokens = tokens
         self.parse = parse
         self.dependencies = dependencies
+        # Parsed from parse on first use
+        self.tree = None
+        self.object = None
+        self.phrase_list = None
+        # Per token indices, also built on first use
+        self.question = None
+        self.command = None
+        self.nearest_nouns = None
+        self.token_phrases = None
 
     @staticmethod
     def from_xml(xml):
@@ -196,55 +194,109 @@ class Sentence(object):
         return ' '.join([t.word for t in self.tokens])
 
     def is_question(self):
-        for t in self.tokens:
-            if t.word == '?':
-                return True
+        if self.question is None:
+            self.question = any(t.word == '?' for t in self.tokens)
+
+        return self.question
 
     def is_command(self):
-        first = self.tokens[0]
-        return (first.pos == 'VB'
-                and first.word.lower() == first.lemma.lower())
+        if self.command is None:
+            first = self.tokens[0]
+            self.command = (first.pos == 'VB'
+                            and first.word.lower() == first.lemma.lower())
+
+        return self.command
+
+    def nearest_noun_indices(self):
+        '''For each token the index of the closest NN or NNS token,
+           the earlier one on a tie, or None if there are no nouns'''
+        if self.nearest_nouns is None:
+            count = len(self.tokens)
+            before = list()
+            last = None
+            for i, t in enumerate(self.tokens):
+                if t.pos in ['NN', 'NNS']:
+                    last = i
+                before.append(last)
+
+            nearest = [None] * count
+            last = None
+            for i in reversed(range(count)):
+                if self.tokens[i].pos in ['NN', 'NNS']:
+                    last = i
+                if before[i] is None or (last is not None
+                                         and last - i < i - before[i]):
+                    nearest[i] = last
+                else:
+                    nearest[i] = before[i]
+
+            self.nearest_nouns = tuple(nearest)
+
+        return self.nearest_nouns
+
+    def phrase_ids(self):
+        '''For each token the set of indices into phrases() of the
+           phrases which contain it'''
+        if self.token_phrases is None:
+            token_phrases = [set() for _ in self.tokens]
+            for phrase_id, phrase in enumerate(self.phrases()):
+                for t in phrase:
+                    while t >= len(token_phrases):
+                        token_phrases.append(set())
+                    token_phrases[t].add(phrase_id)
+
+            self.token_phrases = tuple(frozenset(p) for p in token_phrases)
+
+        return self.token_phrases
+
+    def in_same_phrase(self, token_index1, token_index2):
+        phrase_ids = self.phrase_ids()
+        return not phrase_ids[token_index1].isdisjoint(
+            phrase_ids[token_index2])
 
     def object_of_sentence(self):
-        return self.search_for_object(self.parse_tree(), 0)
+        if self.object is None:
+            self.object = self.search_for_object(self.parse_tree())
+
+        return self.object
 
     @classmethod
-    def search_for_object(cls, tree, index):
+    def search_for_object(cls, tree):
         if tree.value in ['PP']:
             return (None, -1)
 
         if tree.value in ['NN', 'NNS']:
-            return (tree.children[0].value, index)
+            return (tree.children[0].value, tree.start)
 
         for child in tree.children:
-            v = cls.search_for_object(child, index)
-            index += child.token_count()
+            v = cls.search_for_object(child)
             if v[0] is not None:
                 return v
 
         return (None, -1)
 
     def phrases(self):
-        return self.phrases_from_tree(self.parse_tree(), 0)
+        if self.phrase_list is None:
+            self.phrase_list = self.phrases_from_tree(self.parse_tree())
+
+        return self.phrase_list
 
     @classmethod
-    def phrases_from_tree(cls, tree, index):
+    def phrases_from_tree(cls, tree):
         if tree.children and tree.value[-1] == 'P':
-            tokens = tree.token_count()
-            return [list(range(index, index + tokens))]
+            return [list(range(tree.start, tree.end))]
 
         phrases = list()
         for c in tree.children:
-            sub_phrases = cls.phrases_from_tree(c, index)
-            for sub in sub_phrases:
-                phrases.append(sub)
-
-            index += c.token_count()
+            phrases.extend(cls.phrases_from_tree(c))
 
         return phrases
 
     def parse_tree(self):
-        return ParseTree.from_parse_string(self.parse)
+        if self.tree is None:
+            self.tree = ParseTree.from_parse_string(self.parse)
+
+        return self.tree
 
     def __str__(self):
         return json.dumps(self.to_json())
@@ -0,0 +1,152 @@
+import cPickle
+import os
+import xml.etree.cElementTree as ET
+from array import array
+
+from nlp import NLP, Sentence, Token, Dependency
+
+# Changing the layout of the cached records invalidates the
+# whole cache file. Increment this whenever that layout changes.
+FORMAT_VERSION = 1
+
+# Each token is stored as this many string ids, in this order
+TOKEN_FIELDS = ('word', 'lemma', 'POS', 'NER', 'NormalizedNER')
+# Each dependency is stored as kind, relation, governor and dependent
+DEPENDENCY_WIDTH = 4
+
+
+class StringTable(object):
+    '''Maps each distinct string in the corpus to a small integer so
+       tokens and dependencies can be stored as flat integer arrays.
+       Id 0 is always None for fields missing from the XML'''
+    def __init__(self, strings=None):
+        self.strings = strings if strings is not None else [None]
+        self.ids = {s: i for i, s in enumerate(self.strings)}
+
+    def id(self, s):
+        string_id = self.ids.get(s)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[s] = string_id
+            self.strings.append(s)
+
+        return string_id
+
+
+class NLPCache(object):
+    '''Stores the CoreNLP parses of a whole corpus in one binary file.
+       Every sentence is a token id array, a parse id and a dependency
+       id array indexing a shared string table. Entries are stamped
+       with the size and modification time of their XML file so only
+       changed parses are read again'''
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+
+    def load(self):
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, 'rb') as f_handle:
+                cached = cPickle.load(f_handle)
+            if cached['version'] == FORMAT_VERSION:
+                return StringTable(cached['strings']), cached['problems']
+
+        return StringTable(), dict()
+
+    def store(self, strings, problems):
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        # Write then rename so a concurrent reader never sees
+        # a partially written cache
+        tmp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f_handle:
+            cPickle.dump({'version': FORMAT_VERSION,
+                          'strings': strings.strings,
+                          'problems': problems},
+                         f_handle, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.cache_path)
+
+    @staticmethod
+    def stamp(file_path):
+        stat = os.stat(file_path)
+        return (os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+
+    def read_all(self, parse_dir, indices):
+        '''Returns a dict from each index to its NLP, reading the
+           XML only for problems missing from the cache'''
+        strings, problems = self.load()
+
+        changed = False
+        natural_language = dict()
+        for i in indices:
+            file_path = os.path.join(parse_dir, NLP.FILE_FORMAT.format(i))
+            stamp = self.stamp(file_path)
+            entry = problems.get(i)
+            if entry is None or entry[0] != stamp:
+                entry = (stamp, self.read_xml(file_path, strings))
+                problems[i] = entry
+                changed = True
+
+            natural_language[i] = self.nlp_from_record(entry[1],
+                                                       strings.strings)
+
+        if changed:
+            self.store(strings, problems)
+
+        return natural_language
+
+    @staticmethod
+    def read_xml(file_path, strings):
+        '''Streams through the XML with iterparse building the compact
+           record directly, without keeping the element tree around'''
+        sentences = list()
+        tags = list()
+        tokens = parse = dependencies = kind = None
+        for event, elem in ET.iterparse(file_path, events=('start', 'end')):
+            if event == 'start':
+                tags.append(elem.tag)
+                parent = tags[-2] if len(tags) > 1 else None
+                # Coreference mentions also have sentence elements
+                if elem.tag == 'sentence' and parent == 'sentences':
+                    tokens = array('i')
+                    parse = strings.id(None)
+                    dependencies = array('i')
+                elif elem.tag == 'dependencies' and parent == 'sentence':
+                    kind = elem.get('type').replace('-dependencies', '')
+                continue
+
+            tags.pop()
+            parent = tags[-1] if tags else None
+            if elem.tag == 'token' and parent == 'tokens':
+                tokens.extend(strings.id(elem.findtext(field))
+                              for field in TOKEN_FIELDS)
+                elem.clear()
+            elif elem.tag == 'parse' and parent == 'sentence':
+                parse = strings.id(elem.text or '')
+            elif elem.tag == 'dep' and parent == 'dependencies':
+                dependencies.extend(
+                    (strings.id(kind), strings.id(elem.get('type')),
+                     strings.id(elem.find('governor').get('idx')),
+                     strings.id(elem.find('dependent').get('idx'))))
+                elem.clear()
+            elif elem.tag == 'sentence' and parent == 'sentences':
+                sentences.append((tokens, parse, dependencies))
+                elem.clear()
+
+        return sentences
+
+    @staticmethod
+    def nlp_from_record(record, strings):
+        width = len(TOKEN_FIELDS)
+        sentences = list()
+        for token_ids, parse_id, dependency_ids in record:
+            tokens = [Token(*[strings[s] for s in token_ids[t:t + width]])
+                      for t in xrange(0, len(token_ids), width)]
+            dependencies = [
+                Dependency(*[strings[s]
+                             for s in dependency_ids[d:d + DEPENDENCY_WIDTH]])
+                for d in xrange(0, len(dependency_ids), DEPENDENCY_WIDTH)]
+            sentences.append(Sentence(tokens, strings[parse_id],
+                                      dependencies))
+
+        return NLP(sentences)
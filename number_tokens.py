@@ -0,0 +1,95 @@
+from text_to_int import try_text_to_int
+from util import try_parse_float
+
+# These number words are fair game to replace in the text
+# since they are a natural language representation of numerical
+# operation. 'Twice' is equivalent to '2.0 times'
+# This is distinct from the case of 'problem constants' like
+# 0.01 for percent (%) problems
+SPECIAL_NUMBER_WORDS = {'twice': 2.0,
+                        'triple': 3.0,
+                        'half': 0.5,
+                        'thrice': 3.0,
+                        'double': 2.0}
+
+
+class NumberRecognizer(object):
+    '''Finds the numbers each token stands for. Tokens with the same
+       word and NER tags always stand for the same numbers so each
+       distinct one is classified once and looked up after that'''
+    def __init__(self):
+        self.known = dict()
+
+    @staticmethod
+    def key(token):
+        return (token.word, token.ner, token.normalized_ner)
+
+    def token_numbers(self, token):
+        key = self.key(token)
+        numbers = self.known.get(key)
+        if numbers is None:
+            numbers = self.classify(*key)
+            self.known[key] = numbers
+
+        return numbers
+
+    def classify_tokens(self, tokens):
+        '''Bulk mode for a whole corpus which classifies each distinct
+           token which has not been seen before'''
+        unseen = {self.key(t) for t in tokens} - set(self.known)
+        for key in unseen:
+            self.known[key] = self.classify(*key)
+
+    @staticmethod
+    def parse_number_word(w):
+        special = SPECIAL_NUMBER_WORDS.get(w.lower())
+        if special is not None:
+            return special
+
+        from_text = try_text_to_int(w)
+        if from_text is None:
+            return None
+
+        return float(from_text)
+
+    @staticmethod
+    def clean(s):
+        for c in ['<', '>']:
+            s = s.replace(c, '')
+
+        return s
+
+    @classmethod
+    def classify(cls, word, ner, normalized_ner):
+        '''Returns a tuple of the absolute values of the numbers the
+           token stands for, usually empty'''
+        from_number_word = cls.parse_number_word(word)
+        if from_number_word is not None:
+            return (abs(from_number_word),)
+
+        from_word = try_parse_float(word)
+        if from_word is not None:
+            return (abs(from_word),)
+
+        numbers = list()
+        if '-' in word:
+            for part in word.split('-'):
+                from_split = try_parse_float(part)
+                if from_split is None:
+                    from_split = cls.parse_number_word(part)
+                if from_split is not None:
+                    numbers.append(abs(from_split))
+
+        # In question 2189 there is a blank in the text '___'
+        # which is interpreted as a NUMBER but with no value
+        if ner == 'NUMBER' and normalized_ner is not None:
+            from_number_ner = try_parse_float(cls.clean(normalized_ner))
+            if from_number_ner is not None:
+                numbers.append(abs(from_number_ner))
+        elif ner == 'MONEY':
+            no_dollar_sign = normalized_ner.strip('$')
+            from_money_ner = try_parse_float(no_dollar_sign)
+            if from_money_ner is not None:
+                numbers.append(abs(from_money_ner))
+
+        return tuple(numbers)
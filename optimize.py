@@ -1,4 +1,5 @@
 import random
+from multiprocessing import Pool
 
 import numpy
 from scipy.optimize import fmin_l_bfgs_b
@@ -7,9 +8,62 @@ from classifier import Classifier
 
 MAX_ITERATIONS = 50
 
+# Each worker process keeps its own classifier and
+# copy of the word problems for the whole optimization
+WORKER_STATE = dict()
+
+
+def initialize_worker(feature_extractor, word_problems, wp_template_indices,
+                      unique_templates):
+    parameters = numpy.zeros(len(feature_extractor.ordered_features))
+    WORKER_STATE['classifier'] = Classifier(feature_extractor, parameters,
+                                            unique_templates)
+    WORKER_STATE['word_problems'] = word_problems
+    WORKER_STATE['wp_template_indices'] = wp_template_indices
+    WORKER_STATE['unique_templates'] = unique_templates
+
+
+def shard_log_likelihood_and_gradient(task):
+    parameters, shard, shard_count = task
+    classifier = WORKER_STATE['classifier']
+    classifier.parameters = parameters
+    return classifier.log_likelihood_and_gradient(
+        WORKER_STATE['word_problems'][shard::shard_count],
+        WORKER_STATE['wp_template_indices'][shard::shard_count],
+        WORKER_STATE['unique_templates'])
+
+
+class LikelihoodPool(object):
+    '''Splits the word problems across worker processes. The workers
+       receive everything except the parameters once when they start
+       so each evaluation only sends the parameters'''
+    def __init__(self, workers, feature_extractor, word_problems,
+                 wp_template_indices, unique_templates):
+        self.shard_count = min(workers, len(word_problems))
+        self.pool = Pool(self.shard_count, initialize_worker,
+                         (feature_extractor, word_problems,
+                          wp_template_indices, unique_templates))
+
+    def log_likelihood_and_gradient(self, parameters):
+        tasks = [(parameters, shard, self.shard_count)
+                 for shard in range(self.shard_count)]
+        results = self.pool.map(shard_log_likelihood_and_gradient, tasks, 1)
+
+        total = 0
+        total_gradient = numpy.zeros(len(parameters))
+        for log_likelihood, gradient in results:
+            total += log_likelihood
+            total_gradient += gradient
+
+        return total, total_gradient
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
 
 def optimize_parameters(feature_extractor, word_problems, unique_templates,
-                        wp_template_map):
+                        wp_template_map, workers=1):
     wp_template_indices = [wp_template_map[wp.labeled_example.index]
                            for wp in word_problems]
 
@@ -20,24 +74,33 @@ def optimize_parameters(feature_extractor, word_problems, unique_templates,
 
     classifier = Classifier(feature_extractor, weights, unique_templates)
 
+    pool = None
+    if workers > 1 and len(word_problems) > 1:
+        pool = LikelihoodPool(workers, feature_extractor, word_problems,
+                              wp_template_indices, unique_templates)
+
     # TODO(Eric): add regularization
     #             L^{2} norm and \lambda = 0.1
+    # TODO(Eric): verify that the negative of the gradient is correct
     def func_to_min(parameters):
-        classifier.parameters = parameters
-        return -classifier.log_likelihood(word_problems, wp_template_indices,
-                                          unique_templates)
-
-    # TODO(Eric): verify that the negative here is correct
-    def gradient(parameters):
-        classifier.parameters = parameters
-        return -classifier.log_likelihood_gradient(word_problems,
-                                                   wp_template_indices,
-                                                   unique_templates)
-
-    optimal, final_value, details = fmin_l_bfgs_b(func_to_min, weights,
-                                                  fprime=gradient,
-                                                  maxfun=MAX_ITERATIONS,
-                                                  maxiter=MAX_ITERATIONS)
+        if pool is not None:
+            value, gradient = pool.log_likelihood_and_gradient(parameters)
+        else:
+            classifier.parameters = parameters
+            value, gradient = classifier.log_likelihood_and_gradient(
+                word_problems, wp_template_indices, unique_templates)
+
+        return -value, -gradient
+
+    # Without fprime, func_to_min returns both the value and gradient
+    try:
+        optimal, final_value, details = fmin_l_bfgs_b(func_to_min, weights,
+                                                      maxfun=MAX_ITERATIONS,
+                                                      maxiter=MAX_ITERATIONS)
+    finally:
+        if pool is not None:
+            pool.close()
+
     print('final_value: {}'.format(final_value))
     print('details: {}'.format(details))
     classifier.parameters = optimal
@@ -2,9 +2,12 @@ import json
 
 
 class ParseTree(object):
-    def __init__(self, value, children):
+    def __init__(self, value, children, start=None, end=None):
         self.value = value
         self.children = children
+        # The tokens under this node are [start, end) in the sentence
+        self.start = start
+        self.end = end
 
     def __str__(self):
         return json.dumps(self.to_json())
@@ -14,17 +17,13 @@ class ParseTree(object):
                 'children': [c.to_json() for c in self.children]}
 
     def token_count(self):
-        if len(self.children) == 0:
-            return 1
-
-        count = 0
-        for c in self.children:
-            count += c.token_count()
-
-        return count
+        return self.end - self.start
 
     @classmethod
     def from_parse_string(cls, parse_string):
+        '''Builds the tree in a single pass over the tokens with a
+           stack of open nodes, numbering the leaves as it goes so each
+           node knows the span [start, end) of tokens it covers'''
         parse_string = parse_string.strip()
         expand_parens = (parse_string
                          .replace('(', '( ')
@@ -33,36 +32,55 @@ class ParseTree(object):
         if tokens[0] != '(' or tokens[1] != 'ROOT' or tokens[-1] != ')':
             raise Exception('could not parse: {}'.format(parse_string))
 
-        return cls.from_tokens('Root', tokens[2:-1])
-
-    @classmethod
-    def from_tokens(cls, root, tokens):
-        if len(tokens) == 1:
-            return ParseTree(root, [ParseTree(tokens[0], list())])
-
-        sub_trees = list()
-        sub_tree = list()
-        nesting_depth = 0
-        for t in tokens:
-            sub_tree.append(t)
+        root = ParseTree('Root', list(), 0)
+        stack = [root]
+        leaf_count = 0
+        i = 2
+        end = len(tokens) - 1
+        while i < end:
+            t = tokens[i]
             if t == '(':
-                nesting_depth += 1
+                if i + 1 >= end or tokens[i + 1] in ['(', ')']:
+                    raise Exception('could not parse: {}'
+                                    .format(parse_string))
+
+                node = ParseTree(tokens[i + 1], list(), leaf_count)
+                stack[-1].children.append(node)
+                stack.append(node)
+                i += 2
+                continue
 
             if t == ')':
-                nesting_depth -= 1
+                if len(stack) == 1:
+                    raise Exception('could not parse: {}'
+                                    .format(parse_string))
 
-            if nesting_depth == 0:
-                sub_trees.append(sub_tree)
-                sub_tree = list()
+                cls.close_node(stack.pop(), leaf_count, parse_string)
+            else:
+                leaf = ParseTree(t, list(), leaf_count, leaf_count + 1)
+                stack[-1].children.append(leaf)
+                leaf_count += 1
 
-        if nesting_depth != 0:
-            raise Exception('could not parse: {}'.format(tokens))
+            i += 1
 
-        parsed_trees = list()
-        for tree in sub_trees:
-            if len(tree) < 4 or tree[0] != '(' or tokens[-1] != ')':
-                raise Exception('could not parse: {}'.format(tokens))
+        if len(stack) != 1:
+            raise Exception('could not parse: {}'.format(parse_string))
 
-            parsed_trees.append(cls.from_tokens(tree[1], tree[2:-1]))
+        root.end = leaf_count
+        cls.check_children(root, parse_string)
+        return root
 
-        return ParseTree(root, parsed_trees)
+    @classmethod
+    def close_node(cls, node, end, parse_string):
+        if len(node.children) == 0:
+            raise Exception('could not parse: {}'.format(parse_string))
+
+        node.end = end
+        cls.check_children(node, parse_string)
+
+    @staticmethod
+    def check_children(node, parse_string):
+        # A word can only appear as the single child of its label
+        has_leaf = any(len(c.children) == 0 for c in node.children)
+        if has_leaf and len(node.children) != 1:
+            raise Exception('could not parse: {}'.format(parse_string))
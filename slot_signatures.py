@@ -39,6 +39,8 @@ class SlotPairSignature(object):
     def __init__(self, slot1, slot2):
         self.slot1 = slot1
         self.slot2 = slot2
+        # Pairs are only made from slots of the same template
+        self.template_index = slot1.template_index
 
     def __str__(self):
         return json.dumps(self.to_json())
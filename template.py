@@ -1,16 +1,33 @@
 import itertools
 import json
+import math
+import random
 
-from sympy import Symbol, linsolve, Mul
+from sympy import Symbol, linsolve, Add, Mul, Matrix, Poly, Float, lambdify
 
 from equation import Equation
 from slot_signatures import SingleSlotSignature, SlotPairSignature
 
+# Solutions are evaluated at fixed random points to cheaply rule out
+# templates and symbol mappings before comparing them symbolically
+FINGERPRINT_SEED = 446
+FINGERPRINT_POINTS = 2
+FINGERPRINT_TOLERANCE = 1e-6
+# Fingerprint values are rounded to this many significant digits
+# for the canonical form so rounding errors do not change its hash
+FINGERPRINT_DIGITS = 6
+
 
 class Template(object):
     def __init__(self, equations, solution):
         self.equations = equations
         self.solution = solution
+        self.canonical = None
+        self.simplified = None
+        self.slots = None
+        self.fingerprint = None
+        self.compiled = None
+        self.completion = None
 
     @classmethod
     def from_equations_and_nlp(cls, equations, nlp):
@@ -69,6 +86,106 @@ class Template(object):
     @classmethod
     def solve(cls, equations):
         unified, unknowns = cls.unify_unknowns(equations)
+        raw_sol = cls.solve_linear_system(unified, unknowns)
+        if raw_sol is None:
+            return cls.solve_degenerate(unified, unknowns)
+
+        sol = dict()
+        for i, u in enumerate(unknowns):
+            sol[u] = Equation(raw_sol[i])
+
+        return sol
+
+    @staticmethod
+    def linear_system(equations, unknowns):
+        '''The coefficient matrix and right hand side of the equations
+           in the order of unknowns, or None if a term is not linear
+           in the unknowns or not a polynomial in the number slots'''
+        unknown_set = set(unknowns)
+        rows = list()
+        right_hand_side = list()
+        for eq in equations:
+            coefficients = {u: list() for u in unknowns}
+            constants = list()
+            for term in Add.make_args(eq.full.expand()):
+                term_unknowns = term.free_symbols & unknown_set
+                if not term_unknowns:
+                    if not term.is_polynomial():
+                        return None
+
+                    constants.append(term)
+                    continue
+
+                if len(term_unknowns) > 1:
+                    return None
+
+                u = term_unknowns.pop()
+                coefficient, dependent = term.as_independent(u)
+                if dependent != u or not coefficient.is_polynomial():
+                    return None
+
+                coefficients[u].append(coefficient)
+
+            rows.append([Add(*coefficients[unknown]) for unknown in unknowns])
+            right_hand_side.append(-Add(*constants))
+
+        return Matrix(rows), Matrix(right_hand_side)
+
+    @classmethod
+    def solve_linear_system(cls, equations, unknowns):
+        '''Solves by Cramer's rule with determinants from fraction free
+           (Bareiss) elimination. Returns None unless the system has
+           exactly one solution and its coefficients are polynomials
+           in the number slots'''
+        if len(equations) != len(unknowns):
+            return None
+
+        system = cls.linear_system(equations, unknowns)
+        if system is None:
+            return None
+
+        matrix, right_hand_side = system
+        determinant = matrix.det(method='bareis').expand()
+        if determinant == 0:
+            return None
+
+        # Cramer's rule leaves a common factor in each fraction's
+        # numerator and denominator. Making the leading coefficient of
+        # the denominator positive, as simplify() does, gives templates
+        # which only differ by that sign the same form. Float
+        # coefficients like 0.01 are divided out entirely, as linsolve
+        # does, so the solution still equals the linsolve one
+        leading = cls.leading_coefficient(determinant)
+        scale = 1
+        if determinant.atoms(Float):
+            scale = leading
+        elif leading < 0:
+            scale = -1
+        determinant = (determinant / scale).expand()
+
+        raw_sol = list()
+        for i in range(len(unknowns)):
+            replaced = matrix.copy()
+            replaced[:, i] = right_hand_side
+            numerator = (replaced.det(method='bareis') / scale).expand()
+            raw_sol.append(numerator / determinant)
+
+        return raw_sol
+
+    @staticmethod
+    def leading_coefficient(e):
+        '''Leading coefficient of the numerator of e, so e may
+           also be a fraction of polynomials'''
+        numerator, _ = e.as_numer_denom()
+        if numerator.is_number:
+            return numerator
+
+        return Poly(numerator, *sorted(numerator.free_symbols, key=str)).LC()
+
+    @classmethod
+    def solve_degenerate(cls, unified, unknowns):
+        '''Systems without exactly one solution are left to linsolve
+           which needs them simplified first'''
         # At this point all substitution is finished so simplify() is safe
         simplified = [cls.simplify(eq.full) for eq in unified]
         sol_set = linsolve(simplified, unknowns)
@@ -127,6 +244,207 @@ class Template(object):
         eq = eq.replace(is_mul_by_one, remove_mul_by_one)
         return eq.simplify()
 
+    def canonical_form(self):
+        '''The number of unknowns and of number slots and the numeric
+           fingerprint rounded to a few digits. Unlike the simplified
+           solution these do not depend on the names of the unknowns
+           and number slots, so two templates which are __eq__ always
+           have the same canonical form. Templates without finite
+           fingerprint values only differ by the counts. The reverse
+           is not guaranteed so __eq__ is still needed when they match'''
+        if self.canonical is None:
+            solution = self.solution or dict()
+            fingerprint = sorted(tuple(self.rounded(v) for v in values)
+                                 for values in self.numeric_fingerprint())
+            self.canonical = (len(solution), len(self.number_slots()),
+                              tuple(fingerprint))
+
+        return self.canonical
+
+    @staticmethod
+    def rounded(value):
+        '''value to FINGERPRINT_DIGITS significant digits, where
+           values too small to tell apart from zero are zero'''
+        if abs(value) <= FINGERPRINT_TOLERANCE:
+            return 0.0
+
+        return float('{:.{}g}'.format(value, FINGERPRINT_DIGITS))
+
+    def simplified_solution(self):
+        if self.simplified is None:
+            solution = self.solution or dict()
+            self.simplified = {u: self.simplify(eq.full)
+                               for u, eq in solution.iteritems()}
+
+        return self.simplified
+
+    def number_slots(self):
+        if self.slots is None:
+            solution = self.solution or dict()
+            slots = {n for eq in solution.itervalues() for n in eq.symbols}
+            self.slots = sorted(slots, key=str)
+
+        return self.slots
+
+    def compiled_solution(self):
+        '''For each unknown, in the order of self.solution, the number
+           slots its solution depends on and the solution compiled to a
+           function of all number slots in the order of number_slots().
+           The functions only use arithmetic operators so they take
+           floats as well as numpy arrays'''
+        if self.compiled is None:
+            slots = self.number_slots()
+            solution = self.solution or dict()
+            self.compiled = [(u, sorted(eq.symbols, key=str),
+                              lambdify(slots, eq.full, 'math'))
+                             for u, eq in solution.iteritems()]
+
+        return self.compiled
+
+    @staticmethod
+    def finite_value(f, values):
+        '''f at values as a float, or None on division by zero
+           or a value which is not finite'''
+        try:
+            value = float(f(*values))
+        except (ZeroDivisionError, OverflowError, ValueError, TypeError):
+            return None
+
+        if math.isinf(value) or math.isnan(value):
+            return None
+
+        return value
+
+    def evaluate(self, values):
+        '''Maps each unknown to its value given the values of all
+           number slots in the order of number_slots(). None if
+           any unknown has no finite value'''
+        evaluated = dict()
+        for u, _, f in self.compiled_solution():
+            value = self.finite_value(f, values)
+            if value is None:
+                return None
+
+            evaluated[u] = value
+
+        return evaluated
+
+    def solve_numbers(self, numbers):
+        '''Evaluates the solution given a map from number slots to
+           values. An unknown is None if it depends on a slot
+           without a value or if its value is not finite'''
+        return [self.solve_unknown(i, numbers)
+                for i in range(len(self.compiled_solution()))]
+
+    def solve_unknown(self, unknown_index, numbers):
+        '''solve_numbers for only the unknown at that index'''
+        _, slots, f = self.compiled_solution()[unknown_index]
+        if any(numbers.get(s) is None for s in slots):
+            return None
+
+        # The function ignores the slots this unknown does not
+        # depend on so they are passed as None when not filled yet
+        return self.finite_value(f, [numbers.get(s)
+                                     for s in self.number_slots()])
+
+    def unknowns_completed_at(self, number_slots):
+        '''When number slots are filled in the given order, the i-th
+           entry lists the indices of the unknowns whose slots are
+           all filled once i number slots are filled but not before'''
+        if self.completion is None or self.completion[0] != number_slots:
+            position = {s: i + 1 for i, s in enumerate(number_slots)}
+            completed = [list() for _ in range(len(number_slots) + 1)]
+            for i, (_, slots, _) in enumerate(self.compiled_solution()):
+                completed[max([position[s] for s in slots] or [0])].append(i)
+
+            self.completion = (number_slots, completed)
+
+        return self.completion[1]
+
+    def solve_number_matrix(self, values):
+        '''values has a row per assignment of the number slots with
+           the columns in the order of number_slots(). Returns a
+           matrix of solutions with a column per unknown in the order
+           of self.solution and a mask of which solutions are finite'''
+        # Only training solves derivations so the other actions
+        # do not pay for importing numpy
+        import numpy
+
+        values = numpy.asarray(values, dtype=float)
+        row_count = values.shape[0]
+        columns = [values[:, i] for i in range(values.shape[1])]
+        compiled = self.compiled_solution()
+        solutions = numpy.empty((row_count, len(compiled)))
+        with numpy.errstate(all='ignore'):
+            for i, (_, _, f) in enumerate(compiled):
+                solutions[:, i] = numpy.broadcast_to(
+                    numpy.asarray(f(*columns), dtype=float), (row_count,))
+
+        # Division by zero gives inf or nan for arrays instead of
+        # raising, so the mask drops the same values as finite_value
+        return solutions, numpy.isfinite(solutions)
+
+    @staticmethod
+    def fingerprint_points(slot_count):
+        rng = random.Random(FINGERPRINT_SEED + slot_count)
+        return [[rng.uniform(1.0, 10.0) for _ in range(slot_count)]
+                for _ in range(FINGERPRINT_POINTS)]
+
+    @staticmethod
+    def is_close(a, b):
+        return abs(a - b) <= FINGERPRINT_TOLERANCE * max(1.0, abs(a), abs(b))
+
+    def numeric_fingerprint(self):
+        '''For each unknown the sorted values of its solution
+           over every ordering of the fingerprint points.
+           Renaming unknowns or number slots leaves it unchanged'''
+        if self.fingerprint is not None:
+            return self.fingerprint
+
+        values = {u: list() for u, _, _ in self.compiled_solution()}
+        for point in self.fingerprint_points(len(self.number_slots())):
+            by_unknown = {u: list() for u in values}
+            for ordering in itertools.permutations(point):
+                evaluated = self.evaluate(ordering)
+                if evaluated is None:
+                    continue
+
+                for u, v in evaluated.iteritems():
+                    by_unknown[u].append(v)
+
+            for u, vs in by_unknown.iteritems():
+                values[u].extend(sorted(vs))
+
+        self.fingerprint = values.values()
+        return self.fingerprint
+
+    def fingerprint_matches(self, other):
+        unmatched = list(other.numeric_fingerprint())
+        for values in self.numeric_fingerprint():
+            for i, other_values in enumerate(unmatched):
+                if (len(values) == len(other_values)
+                        and all(self.is_close(a, b)
+                                for a, b in zip(values, other_values))):
+                    unmatched.pop(i)
+                    break
+            else:
+                return False
+
+        return len(unmatched) == 0
+
+    def values_match(self, self_values, other_values, u_map):
+        '''Whether u_map is consistent with the solutions of
+           both templates evaluated at the same points'''
+        for self_v, other_v in zip(self_values, other_values):
+            if self_v is None or other_v is None:
+                continue
+
+            for self_u, other_u in u_map.iteritems():
+                if not self.is_close(self_v[self_u], other_v[other_u]):
+                    return False
+
+        return True
+
     @classmethod
     def no_eval_replace(cls, e, old, new):
         if e == old:
@@ -168,7 +486,7 @@ class Template(object):
         return signatures
 
     def __hash__(self):
-        return 1
+        return hash(self.canonical_form())
 
     def __eq__(self, other):
         self_unks = set(self.solution.keys())
@@ -183,20 +501,38 @@ class Template(object):
         if self_num_slots != other_num_slots:
             return False
 
+        if not self.fingerprint_matches(other):
+            return False
+
+        # Only mappings which agree numerically at the fingerprint
+        # points need to be compared symbolically
+        self_slots = self.number_slots()
+        other_slots = other.number_slots()
+        points = self.fingerprint_points(len(self_slots))
+        self_values = [self.evaluate(p) for p in points]
+
         unk_mappings = self.map_symbols(self_unks, other_unks)
         num_mappings = self.map_symbols(self_num_slots, other_num_slots)
         for n_map in num_mappings:
+            other_values = list()
+            for p in points:
+                by_slot = dict(zip(self_slots, p))
+                other_values.append(other.evaluate(
+                    [by_slot[n_map[n]] for n in other_slots]))
+
             for u_map in unk_mappings:
+                if not self.values_match(self_values, other_values, u_map):
+                    continue
+
                 all_match = True
                 for self_u, other_u in u_map.iteritems():
-                    self_eq = self.solution[self_u].full
                     other_eq = other.solution[other_u].full
                     other_eq = other_eq.xreplace(n_map)
 
                     # If the equations are not equal after this
                     # transformation, then this combo of n_map, u_map
                     # will not work
-                    self_simp = self.simplify(self_eq)
+                    self_simp = self.simplified_solution()[self_u]
                     other_simp = self.simplify(other_eq)
                     if self_simp != other_simp:
                         all_match = False
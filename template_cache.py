@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+
+from nlp import NLP
+
+# Changing how templates are extracted invalidates every cached
+# template. Increment this whenever that code changes.
+CODE_VERSION = 4
+
+
+class TemplateCache(object):
+    '''Stores the template extracted for each word problem on disk.
+       Entries are addressed by a hash of everything the extraction
+       depends on so a changed problem simply misses the cache'''
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, example, parse_dir):
+        file_name = NLP.FILE_FORMAT.format(example.index)
+        with open(os.path.join(parse_dir, file_name), 'rb') as f_handle:
+            parse_xml = f_handle.read()
+
+        digest = hashlib.sha1()
+        digest.update(str(CODE_VERSION))
+        digest.update(json.dumps(example.equations))
+        digest.update(parse_xml)
+        return digest.hexdigest()
+
+    def path_for_key(self, key):
+        return os.path.join(self.cache_dir, '{}.json'.format(key))
+
+    def load(self, key):
+        path = self.path_for_key(key)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rt') as f_handle:
+            return json.load(f_handle)
+
+    def store(self, key, template_json):
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                # another worker process may have created it first
+                if not os.path.isdir(self.cache_dir):
+                    raise
+
+        # Write then rename so a concurrent reader never sees
+        # a partially written entry
+        path = self.path_for_key(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wt') as f_handle:
+            f_handle.write(json.dumps(template_json))
+        os.rename(tmp_path, path)
+
+    def extract_template_json(self, example, parse_dir, extract):
+        '''Returns the cached template json for the example or
+           calls extract() and caches the result'''
+        key = self.key(example, parse_dir)
+        template_json = self.load(key)
+        if template_json is None:
+            template_json = extract()
+            self.store(key, template_json)
+
+        return template_json
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from labeled_example import LabeledExample
+from main import add_to_template_set, read_template_set, write_template_set
+from test_template import template_from_strings
+
+
+def example(index):
+    return LabeledExample(index, '', list(), list())
+
+
+class AddTemplatesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.templates_path = os.path.join(self.directory, 'templates.json')
+        existing = template_from_strings('-n_0*u_0_0 + n_2*u_0_0 - n_1')
+        write_template_set(self.templates_path, [existing], {0: 0})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add_templates(self, examples, templates):
+        '''The steps of add-templates after extracting the templates'''
+        unique, wp_template_map = read_template_set(self.templates_path)
+        add_to_template_set(unique, wp_template_map, examples, templates)
+        write_template_set(self.templates_path, unique, wp_template_map)
+        return read_template_set(self.templates_path)
+
+    def test_existing_template_with_renamed_slots(self):
+        renamed = template_from_strings('-n_2*u_0_0 + n_0*u_0_0 - n_1')
+        unique, wp_template_map = self.add_templates([example(1)],
+                                                     [renamed])
+        self.assertEqual(len(unique), 1)
+        self.assertEqual(wp_template_map, {0: 0, 1: 0})
+
+    def test_new_template_is_appended(self):
+        total = template_from_strings('n_0*u_0_0 + n_2*u_0_0 - n_1')
+        renamed = template_from_strings('-n_2*u_0_0 + n_0*u_0_0 - n_1')
+        unique, wp_template_map = self.add_templates(
+            [example(1), example(2)], [total, renamed])
+        self.assertEqual(len(unique), 2)
+        self.assertEqual(wp_template_map, {0: 0, 1: 1, 2: 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
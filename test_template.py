@@ -0,0 +1,92 @@
+import json
+import os
+import unittest
+
+from sympy import Symbol
+from sympy.parsing.sympy_parser import parse_expr
+
+from equation import Equation
+from template import Template
+
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'unique_templates.json')
+
+
+def template_from_strings(*equations):
+    '''Each string is one equation already generalized to unknown
+       and number slots, with everything moved to the left side'''
+    generalized = [Equation(parse_expr(eq)) for eq in equations]
+    return Template(generalized, Template.solve(generalized))
+
+
+class TemplateEqualityTest(unittest.TestCase):
+    def assert_same_template(self, a, b):
+        self.assertTrue(a == b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len({a, b}), 1)
+
+    def test_renamed_number_slots(self):
+        # simplify() gives these solutions opposite signs
+        original = template_from_strings('-n_0*u_0_0 + n_2*u_0_0 - n_1')
+        renamed = template_from_strings('-n_2*u_0_0 + n_0*u_0_0 - n_1')
+        self.assert_same_template(original, renamed)
+
+    def test_permuted_unknowns_and_number_slots(self):
+        original = template_from_strings('u_0_0 + u_1_0 - n_0',
+                                         'n_1*u_0_1 + n_2*u_1_1 - n_3')
+        permuted = template_from_strings('u_1_0 + u_0_0 - n_3',
+                                         'n_2*u_1_1 + n_0*u_0_1 - n_1')
+        self.assert_same_template(original, permuted)
+
+    def test_different_templates(self):
+        difference = template_from_strings('-n_0*u_0_0 + n_2*u_0_0 - n_1')
+        total = template_from_strings('n_0*u_0_0 + n_2*u_0_0 - n_1')
+        self.assertFalse(difference == total)
+
+    def test_different_templates_with_same_slot_counts(self):
+        difference = template_from_strings('-n_0*u_0_0 + n_2*u_0_0 - n_1')
+        total = template_from_strings('n_0*u_0_0 + n_2*u_0_0 - n_1')
+        product = template_from_strings('n_0*n_2*u_0_0 - n_1')
+        self.assertEqual(len({hash(difference), hash(total),
+                              hash(product)}), 3)
+
+
+class TemplateSolveTest(unittest.TestCase):
+    def assert_solves_to(self, template, numbers, expected):
+        numbers = {Symbol(name): value for name, value in numbers.items()}
+        solution = template.solve_numbers(numbers)
+        self.assertEqual(len(solution), len(expected))
+        for value, expected_value in zip(sorted(solution), sorted(expected)):
+            self.assertAlmostEqual(value, expected_value)
+
+    def test_unknown_divided_by_number_slot(self):
+        template = template_from_strings('u_0_0/n_0 - n_1')
+        self.assert_solves_to(template, {'n_0': 4.0, 'n_1': 3.0}, [12.0])
+
+    def test_unknown_times_float_power_of_number_slot(self):
+        template = template_from_strings('u_0_0*n_0**(-1.0) - n_1')
+        self.assert_solves_to(template, {'n_0': 4.0, 'n_1': 3.0}, [12.0])
+
+    def test_system_with_unknown_divided_by_number_slot(self):
+        template = template_from_strings('u_0_0 + u_1_0 - n_0',
+                                         'u_0_1/n_1 - u_1_1')
+        self.assert_solves_to(template, {'n_0': 10.0, 'n_1': 2.0},
+                              [20.0 / 3, 10.0 / 3])
+
+
+class CommittedTemplatesTest(unittest.TestCase):
+    def test_equal_to_their_equations_solved_again(self):
+        '''Trained parameters refer to these templates by index, so
+           solving their equations again must give equal templates'''
+        with open(TEMPLATES_PATH, 'rt') as f_handle:
+            parsed = json.load(f_handle)
+
+        for i, template_json in enumerate(parsed['templates']):
+            committed = Template.from_json(template_json)
+            solved = Template(committed.equations,
+                              Template.solve(committed.equations))
+            self.assertTrue(committed == solved, 'template {}'.format(i))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,48 +1,53 @@
 # taken from:
 # http://stackoverflow.com/questions/493174/is-there-a-way-to-convert-number-words-to-integers
 
+# Built once rather than on every call, mapping each word
+# to its (scale, increment)
+NUMBER_WORDS = dict()
+UNITS = ["zero", "one", "two", "three", "four", "five", "six", "seven",
+         "eight", "nine", "ten", "eleven", "twelve", "thirteen",
+         "fourteen", "fifteen", "sixteen", "seventeen", "eighteen",
+         "nineteen"]
 
-def text_to_int(textnum, numwords={}):
+TENS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty",
+        "seventy", "eighty", "ninety"]
+
+SCALES = ["hundred", "thousand", "million", "billion", "trillion"]
+
+NUMBER_WORDS["and"] = (1, 0)
+for idx, word in enumerate(UNITS):
+    NUMBER_WORDS[word] = (1, idx)
+for idx, word in enumerate(TENS):
+    NUMBER_WORDS[word] = (1, idx * 10)
+for idx, word in enumerate(SCALES):
+    NUMBER_WORDS[word] = (10 ** (idx * 3 or 2), 0)
+
+ORDINAL_WORDS = {'first': 1, 'second': 2, 'third': 3, 'fifth': 5,
+                 'eighth': 8, 'ninth': 9, 'twelfth': 12}
+ORDINAL_ENDINGS = [('ieth', 'y'), ('th', '')]
+
+
+def try_text_to_int(textnum):
+    '''Returns None instead of raising for text which is not a number'''
     if textnum.lower() == 'and':
-        raise Exception('and is not a number')
-    if not numwords:
-        units = ["zero", "one", "two", "three", "four", "five", "six", "seven",
-                 "eight", "nine", "ten", "eleven", "twelve", "thirteen",
-                 "fourteen", "fifteen", "sixteen", "seventeen", "eighteen",
-                 "nineteen"]
-
-        tens = ["", "", "twenty", "thirty", "forty", "fifty", "sixty",
-                "seventy", "eighty", "ninety"]
-
-        scales = ["hundred", "thousand", "million", "billion", "trillion"]
-
-        numwords["and"] = (1, 0)
-        for idx, word in enumerate(units):
-            numwords[word] = (1, idx)
-        for idx, word in enumerate(tens):
-            numwords[word] = (1, idx * 10)
-        for idx, word in enumerate(scales):
-            numwords[word] = (10 ** (idx * 3 or 2), 0)
-
-    ordinal_words = {'first': 1, 'second': 2, 'third': 3, 'fifth': 5,
-                     'eighth': 8, 'ninth': 9, 'twelfth': 12}
-    ordinal_endings = [('ieth', 'y'), ('th', '')]
+        return None
 
     textnum = textnum.replace('-', ' ')
 
     current = result = 0
     for word in textnum.split():
-        if word in ordinal_words:
-            scale, increment = (1, ordinal_words[word])
+        if word in ORDINAL_WORDS:
+            scale, increment = (1, ORDINAL_WORDS[word])
         else:
-            for ending, replacement in ordinal_endings:
+            for ending, replacement in ORDINAL_ENDINGS:
                 if word.endswith(ending):
                     word = "%s%s" % (word[:-len(ending)], replacement)
 
-            if word not in numwords:
-                raise Exception("Illegal word: " + word)
+            scale_and_increment = NUMBER_WORDS.get(word)
+            if scale_and_increment is None:
+                return None
 
-            scale, increment = numwords[word]
+            scale, increment = scale_and_increment
 
         current = current * scale + increment
         if scale > 100:
@@ -50,3 +55,11 @@ def text_to_int(textnum, numwords={}):
             current = 0
 
     return result + current
+
+
+def text_to_int(textnum):
+    result = try_text_to_int(textnum)
+    if result is None:
+        raise Exception("Illegal number: " + textnum)
+
+    return result
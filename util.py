@@ -1,4 +1,18 @@
+import re
+
+# Everything float() accepts in a plain string, so the common case
+# of a word which is not a number does not raise an exception
+FLOAT_PATTERN = re.compile(r'\s*[+-]?(?:(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+                           r'|inf(?:inity)?|nan)\s*\Z', re.IGNORECASE)
+
+
 def try_parse_float(s):
+    if isinstance(s, str):
+        if FLOAT_PATTERN.match(s) is None:
+            return None
+
+        return float(s)
+
     try:
         return float(s)
     except ValueError:
@@ -9,6 +9,9 @@ class WordProblem(object):
         self.labeled_example = labeled_example
         self.nlp = nlp
         self.template = None
+        # Set by features.PreparedWordProblem the first time
+        # features are extracted for this problem
+        self.prepared = None
 
     def extract_template(self):
         parsed_equations = [Equation.from_string(eq)